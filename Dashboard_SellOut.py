@@ -1,11 +1,13 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import os
+import time
 import numpy as np
-import io
+import json
 from st_aggrid import AgGrid, GridOptionsBuilder, JsCode, GridUpdateMode
+import datos_sellout as ds
+import motores_sellout as ms
 
 # --------------------------------------------------------------------------
 # 1. CONFIGURACIÓN DE PÁGINA (DEBE SER LO PRIMERO SIEMPRE)
@@ -29,342 +31,273 @@ if password not in CLAVES_VALIDAS:
 
 # Si pasa el stop(), muestra el resto
 st.sidebar.success("Acceso Concedido ✅")
+# Traza de este rerun: tiempos por etapa y aciertos de caché (log de métricas y panel de admin)
+ds.iniciar_traza("dashboard")
 st.title("🌍 Inteligencia de Clientes: Sell Out & Zonas")
 st.markdown("---")
 
-# Rutas Dinámicas (Carpeta Raíz)
-CARPETA_ACTUAL = os.path.dirname(os.path.abspath(__file__))
-
-# --------------------------------------------------------------------------
-# 3. FUNCIONES DE CARGA DE DATOS (ADAPTADO A CARPETA RAÍZ)
 # --------------------------------------------------------------------------
-@st.cache_data
-def cargar_sell_out_neuma():
-    """Carga el Sell Out desde la raíz, ignorando los maestros de Zonas/CAI."""
-    # Ahora buscamos directamente en la carpeta actual
-    ruta_folder = CARPETA_ACTUAL
-    archivo_encontrado = None
-    
-    if os.path.exists(ruta_folder):
-        for f in os.listdir(ruta_folder):
-            # Filtramos para encontrar SOLO el archivo de ventas
-            # Debe tener "Sell Out" o "SO", ser Excel/CSV, NO ser temporal (~$)
-            # Y MUY IMPORTANTE: NO debe ser el archivo de Zonas ni el Histórico
-            if ("Sell Out" in f or "SO" in f) and (f.endswith(".xlsx") or f.endswith(".csv")):
-                if not f.startswith("~$") and "Zonas" not in f and "historico" not in f and "CAI" not in f:
-                    archivo_encontrado = os.path.join(ruta_folder, f)
-                    break
-    
-    if archivo_encontrado:
-        try:
-            es_csv = archivo_encontrado.lower().endswith(".csv")
-            
-            # Función "Cazador de Encabezados"
-            def leer_con_header_dinamico(path, is_csv):
-                if is_csv:
-                    df_raw = pd.read_csv(path, header=None, nrows=15)
-                else:
-                    xl = pd.ExcelFile(path)
-                    hoja = "Sell Out" if "Sell Out" in xl.sheet_names else xl.sheet_names[0]
-                    df_raw = pd.read_excel(path, sheet_name=hoja, header=None, nrows=15)
-
-                fila_header = 0
-                for i, row in df_raw.iterrows():
-                    fila_texto = row.astype(str).str.upper().tolist()
-                    if "CAI" in fila_texto or "FECHA" in fila_texto or "CLIENTE" in fila_texto or "CANTIDAD" in fila_texto:
-                        fila_header = i
-                        break
-                
-                if is_csv: return pd.read_csv(path, header=fila_header)
-                else: return pd.read_excel(path, sheet_name=hoja, header=fila_header)
-
-            df = leer_con_header_dinamico(archivo_encontrado, es_csv)
-            
-            # Limpieza básica
-            df.columns = [str(c).upper().strip() for c in df.columns]
-            
-            correcciones = {
-                'ANO': 'AÑO', 'YEAR': 'AÑO', 'MONTH': 'MES', 'DATE': 'FECHA',
-                'NOMBRE CLIENTE': 'CLIENTE', 'CUSTOMER': 'CLIENTE',
-                'CODIGO': 'CAI', 'MATERIAL': 'CAI', 'ARTICULO': 'CAI' 
-            }
-            renames_final = {}
-            for k, v in correcciones.items():
-                if k in df.columns and v not in df.columns:
-                    renames_final[k] = v
-                elif k in df.columns and v in df.columns:
-                    continue 
-            
-            if renames_final:
-                df.rename(columns=renames_final, inplace=True)
-
-            if 'CLIENTE' in df.columns: 
-                df['CLIENTE'] = df['CLIENTE'].astype(str).str.strip().str.upper().apply(lambda x: x[:-1] if x.endswith('.') else x)
-            
-            if 'FECHA' in df.columns:
-                df['FECHA_DT'] = pd.to_datetime(df['FECHA'], errors='coerce')
-            elif 'AÑO' in df.columns and 'MES' in df.columns:
-                df['AÑO'] = pd.to_numeric(df['AÑO'], errors='coerce').fillna(0).astype(int)
-                df['MES'] = pd.to_numeric(df['MES'], errors='coerce').fillna(1).astype(int)
-                df['FECHA_DT'] = pd.to_datetime(df[['AÑO', 'MES']].assign(DAY=1), errors='coerce')
-            
-            if 'CAI' not in df.columns:
-                candidato = next((c for c in df.columns if c.startswith("COD") or c.startswith("MAT")), None)
-                if candidato: df.rename(columns={candidato: 'CAI'}, inplace=True)
-                else:
-                    st.error(f"❌ No se detectó columna CAI en archivo de ventas: {os.path.basename(archivo_encontrado)}")
-                    st.stop()
-
-            return df
-
-        except Exception as e:
-            st.error(f"Error procesando archivo de ventas: {e}")
-            return None
-            
-    st.warning("⚠️ No encontré el archivo de Ventas (Sell Out) en la carpeta raíz.")
-    return None
-
-@st.cache_data
-def cargar_maestro_zonas_seguro():
-    """Carga Sell Out Zonas.xlsx desde la raíz."""
-    # Buscamos directamente el archivo en la raíz
-    possible_names = ["Sell Out Zonas.xlsx", "Sell Out Zonas.xls"]
-    archivo_path = None
-    
-    for name in possible_names:
-        temp_path = os.path.join(CARPETA_ACTUAL, name)
-        if os.path.exists(temp_path):
-            archivo_path = temp_path
-            break
-    
-    if archivo_path:
-        try:
-            xl = pd.ExcelFile(archivo_path)
-            sheet = 'Sell Out' if 'Sell Out' in xl.sheet_names else xl.sheet_names[0]
-            df_z = pd.read_excel(xl, sheet_name=sheet)
-            df_z.columns = [str(c).strip().upper() for c in df_z.columns]
-            
-            if 'AM' in df_z.columns: df_z.rename(columns={'AM': 'ACCOUNT MANAGER'}, inplace=True)
-            if 'ACOOUNT MANAGER' in df_z.columns: df_z.rename(columns={'ACOOUNT MANAGER': 'ACCOUNT MANAGER'}, inplace=True)
-            
-            cols_permitidas = ['COD.CLIENTE', 'ACCOUNT MANAGER', 'DEPARTAMENTO', 'PROVINCIA', 'DISTRITO']
-            cols_finales = [c for c in cols_permitidas if c in df_z.columns]
-            df_z = df_z[cols_finales]
-            
-            if 'COD.CLIENTE' in df_z.columns:
-                df_z = df_z.drop_duplicates('COD.CLIENTE')
-                df_z['COD.CLIENTE'] = df_z['COD.CLIENTE'].astype(str).str.strip()
-                return df_z
-        except Exception as e:
-            st.error(f"Error procesando Zonas: {e}")
-    return None
-
-@st.cache_data
-@st.cache_data
-def cargar_maestro_filtros():
-    """Carga el catálogo buscando DENOMINATION (Descripción) con inteligencia."""
-    # Buscamos directamente el archivo en la raíz
-    nombre_archivo = "CAI historico 2.xlsx"
-    archivo_path = os.path.join(CARPETA_ACTUAL, nombre_archivo)
-    
-    # Intento de búsqueda insensible a mayúsculas/minúsculas (para Linux)
-    if not os.path.exists(archivo_path):
-        for f in os.listdir(CARPETA_ACTUAL):
-            if f.lower() == nombre_archivo.lower():
-                archivo_path = os.path.join(CARPETA_ACTUAL, f)
-                break
-
-    if os.path.exists(archivo_path):
-        try:
-            df = pd.read_excel(archivo_path)
-            df.columns = [str(c).upper().strip() for c in df.columns]
-            
-            # --- DICCIONARIO DE SINÓNIMOS PARA UNIFICAR ---
-            renames = {
-                # Segmentos
-                'SEGMENTO': 'SEGMENTO LB', 
-                'MACRO MACHINE': 'MACRO_ MACHINE',
-                # Clasificación
-                'CLASIFICACION DR': 'CLASIFICACIÓN DR',
-                # Códigos
-                'CODIGO': 'CAI', 'COD': 'CAI', 'MATERIAL': 'CAI',
-                # === AQUÍ ESTÁ EL ARREGLO DE LA DESCRIPCIÓN ===
-                'DESCRIPCION': 'DENOMINATION',
-                'DESCRIPCIÓN': 'DENOMINATION',
-                'NOMBRE': 'DENOMINATION',
-                'NOMBRE ARTICULO': 'DENOMINATION',
-                'MATERIAL DESCRIPTION': 'DENOMINATION',
-                'TXT.BREVE MATERIAL': 'DENOMINATION'
-            }
-            
-            # Aplicar renombres
-            # Usamos un bucle para evitar errores si la columna no existe
-            cols_renombrar = {}
-            for k, v in renames.items():
-                if k in df.columns and v not in df.columns:
-                    cols_renombrar[k] = v
-            
-            if cols_renombrar:
-                df.rename(columns=cols_renombrar, inplace=True)
-            
-            # Asegurar CAI
-            if 'CAI' not in df.columns:
-                 col_cai = next((c for c in df.columns if "CAI" in c or "COD" in c), "CAI")
-                 df.rename(columns={col_cai: 'CAI'}, inplace=True)
-            
-            # 🔍 DEBUG: Si quieres ver en la web qué columnas leyó, descomenta esto:
-            # st.write("Columnas leídas en Maestro:", list(df.columns))
-            
-            return df
-        except Exception as e:
-            # Esto te dirá en la web si falló la carga
-            st.error(f"Error leyendo el maestro: {e}")
-            pass
-    else:
-        st.warning(f"⚠️ No encuentro el archivo '{nombre_archivo}' en la nube. Verifica el nombre exacto en GitHub.")
-        
-    return None
-
+# 3. CARGA DE DATOS (CACHÉ COMPARTIDA ENTRE SESIONES)
 # --------------------------------------------------------------------------
-# 4. LOGICA PRINCIPAL DE CRUCE
-# --------------------------------------------------------------------------
-df_so_raw = cargar_sell_out_neuma()
-df_zonas = cargar_maestro_zonas_seguro()
-df_maestro = cargar_maestro_filtros()
+# La lectura, el cruce y el cubo viven en datos_sellout.py (sin Streamlit); aquí solo se cachean en memoria
+# por versión de las fuentes y se muestran los avisos que dejó la carga.
+
+def desde_cache(nombre, funcion, *args):
+    """Llama a una función con st.cache_resource midiendo la etapa; si el cuerpo no corrió, fue un acierto."""
+    with ds.medir_etapa(f"memoria:{nombre}"):
+        fallos_antes = fallos_memoria(nombre)
+        resultado = funcion(*args)
+        if fallos_memoria(nombre) == fallos_antes:
+            ds.registrar_cache("memoria", nombre, True)
+    return resultado
+
+def fallos_memoria(nombre):
+    traza = ds.traza_actual()
+    return sum(1 for c in traza["cache"] if c["cache"] == f"memoria:{nombre}" and not c["acierto"]) if traza else 0
+
+def elegir_motor():
+    """Motor de consultas de SELLOUT_MOTOR; si no está instalado se avisa y se usa pandas."""
+    try:
+        return ms.MOTOR_POR_DEFECTO, ms.obtener_motor()
+    except ValueError as e:
+        st.sidebar.warning(f"⚠️ {e}. Se usa pandas.")
+        return "pandas", ms.obtener_motor("pandas")
+
+def mostrar_avisos(avisos):
+    """Muestra los avisos (nivel, mensaje) que dejó la capa de datos."""
+    for nivel, mensaje in avisos:
+        getattr(st, nivel)(mensaje)
+
+@st.cache_resource(max_entries=2, show_spinner="Cruzando ventas con zonas y productos...")
+def construir_tabla_unificada(huella_so, huella_zonas, huella_cai):
+    """Tabla unificada y sus avisos de carga, una sola copia por versión de datos para todas las sesiones."""
+    ds.registrar_cache("memoria", "tabla_unificada", False)
+    avisos = []
+    df = ds.construir_tabla_unificada(huella_so, huella_zonas, huella_cai, avisos=avisos)
+    return df, avisos
+
+@st.cache_resource(max_entries=2, show_spinner="Preparando cubo de ventas...")
+def construir_cubo(huella_so, huella_zonas, huella_cai):
+    """Cubo de ventas (ver datos_sellout.construir_cubo), compartido entre sesiones."""
+    ds.registrar_cache("memoria", "cubo", False)
+    df_unificado, _ = desde_cache("tabla_unificada", construir_tabla_unificada, huella_so, huella_zonas, huella_cai)
+    return ds.construir_cubo(huella_so, huella_zonas, huella_cai, df_unificado=df_unificado)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def construir_indice_filtros(huella_so, huella_zonas, huella_cai):
+    """Índice invertido de los filtros sobre el cubo mensual, compartido entre sesiones."""
+    ds.registrar_cache("memoria", "indice_filtros", False)
+    return ds.construir_indice_filtros(desde_cache("cubo_mensual", construir_cubo_mensual, huella_so, huella_zonas, huella_cai))
+
+@st.cache_resource(max_entries=2, show_spinner="Preparando cubo mensual...")
+def construir_cubo_mensual(huella_so, huella_zonas, huella_cai):
+    """Cubo por mes (filtros, grilla y gráficos), compartido entre sesiones."""
+    ds.registrar_cache("memoria", "cubo_mensual", False)
+    df_cubo = desde_cache("cubo", construir_cubo, huella_so, huella_zonas, huella_cai)
+    return ds.construir_cubo_mensual(huella_so, huella_zonas, huella_cai, df_cubo=df_cubo)
+
+def preparar_version(huellas):
+    """Deja en la caché compartida la tabla, los cubos y el índice de una versión.
+
+    Devuelve (hay_datos, avisos de carga); hay_datos es False si no hay Sell Out.
+    """
+    df_unificado, avisos = desde_cache("tabla_unificada", construir_tabla_unificada, *huellas)
+    if df_unificado is None:
+        return False, avisos
+    desde_cache("indice_filtros", construir_indice_filtros, *huellas)
+    return True, avisos
+
+@st.cache_resource(show_spinner=False)
+def obtener_vigilante():
+    """Un solo vigilante de fuentes por proceso: cuando cambian, prepara la versión nueva en segundo plano."""
+    return ds.VigilanteFuentes(preparar_version)
+
+@st.cache_resource(show_spinner=False)
+def obtener_exportaciones():
+    """Un solo pool de exportaciones por proceso: los archivos grandes se escriben en segundo plano."""
+    return ds.Exportaciones()
+
+# Mientras se prepara una versión nueva se sigue sirviendo la anterior; se lee una vez por rerun
+vigilante = obtener_vigilante()
+nombre_motor, motor_consultas = elegir_motor()
+try:
+    version_datos = vigilante.activa()
+    huellas = version_datos["huellas"]
+    df_unificado, avisos_carga = desde_cache("tabla_unificada", construir_tabla_unificada, *huellas)
+except ds.ColumnaFaltanteError as e:
+    st.error(f"❌ {e}")
+    st.stop()
+mostrar_avisos(avisos_carga)
 
-if df_so_raw is None:
+if df_unificado is None:
     st.error("❌ No se encontró el archivo de datos. Asegúrate de subirlo a la misma carpeta que este script.")
     st.stop()
 
-# 1. Unificar Zonas
-df_unificado = df_so_raw.copy()
-if 'COD.CLIENTE' in df_unificado.columns:
-    df_unificado['COD.CLIENTE'] = df_unificado['COD.CLIENTE'].astype(str).str.strip()
-    if df_zonas is not None:
-        df_unificado = pd.merge(df_unificado, df_zonas, on='COD.CLIENTE', how='left', suffixes=('', '_ZONA_DROP'))
-        cols_drop = [c for c in df_unificado.columns if '_ZONA_DROP' in c]
-        if cols_drop: df_unificado.drop(columns=cols_drop, inplace=True)
-
-        for c in ['ACCOUNT MANAGER', 'DEPARTAMENTO', 'PROVINCIA', 'DISTRITO']:
-            if c in df_unificado.columns: df_unificado[c] = df_unificado[c].fillna("SIN ASIGNAR")
-
-# Salvar CAI si se perdió
-if 'CAI' not in df_unificado.columns:
-    if 'CAI_x' in df_unificado.columns: df_unificado.rename(columns={'CAI_x': 'CAI'}, inplace=True)
-    elif 'CODIGO' in df_unificado.columns: df_unificado.rename(columns={'CODIGO': 'CAI'}, inplace=True)
-
-# 2. Unificar Maestro Productos
-if df_maestro is not None and 'CAI' in df_unificado.columns:
-    df_unificado['CAI_Clean'] = df_unificado['CAI'].astype(str).str.strip()
-    
-    posibles_cols = ['CAI', 'SEGMENTO LB', 'MARCA', 'MACRO_ MACHINE', 'DENOMINATION', 'CLASIFICACIÓN DR', 'CLASIFICACION DR']
-    cols_m = [c for c in posibles_cols if c in df_maestro.columns]
-    
-    maestro_min = df_maestro[cols_m].copy()
-    if 'CLASIFICACION DR' in maestro_min.columns and 'CLASIFICACIÓN DR' not in maestro_min.columns:
-        maestro_min.rename(columns={'CLASIFICACION DR': 'CLASIFICACIÓN DR'}, inplace=True)
-        
-    maestro_min.rename(columns={'SEGMENTO LB': 'Segmento LB', 'MACRO MACHINE': 'MACRO_ MACHINE'}, inplace=True)
-    
-    col_cai_m = next((c for c in maestro_min.columns if "CAI" in c), "CAI")
-    maestro_min['CAI_Clean'] = maestro_min[col_cai_m].astype(str).str.strip()
-    maestro_min = maestro_min.drop(columns=[col_cai_m], errors='ignore').drop_duplicates('CAI_Clean')
-
-    # Merge
-    df_unificado = pd.merge(df_unificado, maestro_min, on='CAI_Clean', how='left')
-    
-    for c in ['Segmento LB', 'MARCA', 'MACRO_ MACHINE', 'DENOMINATION', 'CLASIFICACIÓN DR']:
-        if c in df_unificado.columns: df_unificado[c] = df_unificado[c].fillna("OTROS")
-else:
-    if 'CAI' in df_unificado.columns:
-        df_unificado['CAI_Clean'] = df_unificado['CAI'].astype(str).str.strip()
-    else:
-        df_unificado['CAI_Clean'] = "SIN CAI"
-
 # --------------------------------------------------------------------------
-# 5. FILTROS
+# 4. FILTROS
 # --------------------------------------------------------------------------
+def filtro_cascada(etiqueta, col, mascara, excluir_nan=False):
+    """Multiselect del sidebar sobre el índice; devuelve la máscara de filas actualizada."""
+    if col not in indice_filtros:
+        return mascara
+    opciones = ds.opciones_disponibles(indice_filtros, col, mascara)
+    if excluir_nan:
+        opciones = [x for x in opciones if x != 'nan']
+    seleccion = st.sidebar.multiselect(etiqueta, opciones)
+    if seleccion:
+        selecciones[col] = seleccion
+        mascara = ds.aplicar_seleccion(indice_filtros, col, seleccion, mascara)
+    return mascara
+
+def filtro_busqueda(etiqueta, col, mascara):
+    """Buscador con sugerencias: el multiselect recibe solo lo elegido más los mejores resultados de lo tipeado."""
+    if col not in indice_filtros:
+        return mascara
+    texto = st.sidebar.text_input(f"🔎 {etiqueta}", key=f"buscar_{col}", placeholder="Código o nombre...")
+    elegidos = st.session_state.get(f"filtro_{col}", [])
+    sugerencias = ds.buscar(indice_filtros, col, texto, mascara)
+    # Lo ya elegido sigue en las opciones solo si está en las filas vigentes (si no, Streamlit lo descarta)
+    vigentes = set(ds.opciones_disponibles(indice_filtros, col, mascara)) if elegidos else set()
+    opciones = [v for v in elegidos if v in vigentes] + [v for v in sugerencias if v not in elegidos]
+    etiquetas = ds.etiquetas_busqueda(indice_filtros, col)
+    seleccion = st.sidebar.multiselect(etiqueta, opciones, key=f"filtro_{col}", format_func=lambda v: etiquetas.get(v, v))
+    if seleccion:
+        selecciones[col] = seleccion
+        mascara = ds.aplicar_seleccion(indice_filtros, col, seleccion, mascara)
+    return mascara
+
+df_cubo = desde_cache("cubo", construir_cubo, *huellas)
+df_mes = desde_cache("cubo_mensual", construir_cubo_mensual, *huellas)
+indice_filtros = desde_cache("indice_filtros", construir_indice_filtros, *huellas)
+
+st.sidebar.caption(f"🗂️ Datos v{version_datos['id']} · construidos el "
+                   f"{time.strftime('%d/%m %H:%M', time.localtime(version_datos['construida']))} "
+                   f"en {version_datos['segundos']:.1f} s")
+if vigilante.construyendo is not None:
+    st.sidebar.info("🔄 Cambiaron las fuentes: se está preparando la versión nueva, mientras tanto se muestra la anterior.")
+if vigilante.error:
+    st.sidebar.warning(f"⚠️ No se pudo actualizar los datos ({vigilante.error}). Se sigue mostrando la versión anterior.")
+
 st.sidebar.markdown("### 🎛️ Filtros")
 
-# A. Filtros de Producto
-st.sidebar.subheader("📦 Producto")
-df_so_trend = df_unificado.copy()
-
-# 1. Segmento
-if 'Segmento LB' in df_so_trend.columns:
-    seg_opts = sorted(df_so_trend['Segmento LB'].astype(str).unique())
-    sel_seg = st.sidebar.multiselect("Segmento", seg_opts)
-    if sel_seg: df_so_trend = df_so_trend[df_so_trend['Segmento LB'].isin(sel_seg)]
-
-# 2. Marca
-if 'MARCA' in df_so_trend.columns:
-    marca_opts = sorted(df_so_trend['MARCA'].astype(str).unique())
-    sel_marca = st.sidebar.multiselect("Marca", marca_opts)
-    if sel_marca: df_so_trend = df_so_trend[df_so_trend['MARCA'].isin(sel_marca)]
-
-# 3. Clasificación DR
-if 'CLASIFICACIÓN DR' in df_so_trend.columns:
-    clas_opts = sorted([x for x in df_so_trend['CLASIFICACIÓN DR'].unique() if str(x) != 'nan'])
-    sel_clas_dr = st.sidebar.multiselect("Clasificación DR", clas_opts)
-    if sel_clas_dr: df_so_trend = df_so_trend[df_so_trend['CLASIFICACIÓN DR'].isin(sel_clas_dr)]
-
-# B. Filtros de Zona (Cascada Geográfica)
-st.sidebar.subheader("🌍 Zona / Cliente")
-
-# 1. Manager
-if 'ACCOUNT MANAGER' in df_so_trend.columns:
-    am_opts = sorted(df_so_trend['ACCOUNT MANAGER'].astype(str).unique())
-    sel_am = st.sidebar.multiselect("Account Manager", am_opts)
-    if sel_am: df_so_trend = df_so_trend[df_so_trend['ACCOUNT MANAGER'].isin(sel_am)]
-
-# 2. Departamento
-if 'DEPARTAMENTO' in df_so_trend.columns:
-    dep_opts = sorted(df_so_trend['DEPARTAMENTO'].astype(str).unique())
-    sel_dep = st.sidebar.multiselect("Departamento", dep_opts)
-    if sel_dep: df_so_trend = df_so_trend[df_so_trend['DEPARTAMENTO'].isin(sel_dep)]
-
-# 3. Provincia
-if 'PROVINCIA' in df_so_trend.columns:
-    prov_opts = sorted(df_so_trend['PROVINCIA'].astype(str).unique())
-    sel_prov = st.sidebar.multiselect("Provincia", prov_opts)
-    if sel_prov: df_so_trend = df_so_trend[df_so_trend['PROVINCIA'].isin(sel_prov)]
-
-# 4. Distrito
-if 'DISTRITO' in df_so_trend.columns:
-    dist_opts = sorted(df_so_trend['DISTRITO'].astype(str).unique())
-    sel_dist = st.sidebar.multiselect("Distrito", dist_opts)
-    if sel_dist: df_so_trend = df_so_trend[df_so_trend['DISTRITO'].isin(sel_dist)]
-    
-# C. Filtros de Búsqueda Dinámica
-st.sidebar.subheader("🔍 Búsqueda Específica")
-
-# 1. Filtro por CAI o Descripción (Lista desplegable con búsqueda)
-if 'CAI_Clean' in df_so_trend.columns:
-    # Creamos una lista de opciones que combine CAI y Descripción para que sea fácil identificar
-    if 'DENOMINATION' in df_so_trend.columns:
-        df_so_trend['SEARCH_KEY'] = df_so_trend['CAI_Clean'].astype(str) + " - " + df_so_trend['DENOMINATION'].astype(str)
-    else:
-        df_so_trend['SEARCH_KEY'] = df_so_trend['CAI_Clean'].astype(str)
-    
-    opciones_cai = sorted(df_so_trend['SEARCH_KEY'].unique())
-    sel_cai_input = st.sidebar.multiselect("Seleccionar CAI / Producto:", opciones_cai)
-    
-    if sel_cai_input:
-        df_so_trend = df_so_trend[df_so_trend['SEARCH_KEY'].isin(sel_cai_input)]
-
-# 2. Filtro por Cliente (Lista desplegable con búsqueda)
-if 'CLIENTE' in df_so_trend.columns:
-    opciones_cliente = sorted(df_so_trend['CLIENTE'].unique())
-    sel_cliente_input = st.sidebar.multiselect("Seleccionar Cliente:", opciones_cliente)
-    
-    if sel_cliente_input:
-        df_so_trend = df_so_trend[df_so_trend['CLIENTE'].isin(sel_cliente_input)]
-
-st.sidebar.markdown(f"--- \n**Registros:** {len(df_so_trend)}")
+# None = todas las filas; cada filtro activo la reduce con una intersección de bitmaps
+mascara_filas = None
+# Lo elegido en cada filtro (columna ➝ valores): junto con las huellas es la clave de la caché de grillas
+selecciones = {}
+with ds.medir_etapa("filtros") as registro_filtros:
+    # A. Filtros de Producto
+    st.sidebar.subheader("📦 Producto")
+
+    # 1. Segmento
+    mascara_filas = filtro_cascada("Segmento", 'Segmento LB', mascara_filas)
+
+    # 2. Marca
+    mascara_filas = filtro_cascada("Marca", 'MARCA', mascara_filas)
+
+    # 3. Clasificación DR
+    mascara_filas = filtro_cascada("Clasificación DR", 'CLASIFICACIÓN DR', mascara_filas, excluir_nan=True)
+
+    # B. Filtros de Zona (Cascada Geográfica)
+    st.sidebar.subheader("🌍 Zona / Cliente")
+
+    # 1. Manager
+    mascara_filas = filtro_cascada("Account Manager", 'ACCOUNT MANAGER', mascara_filas)
+
+    # 2. Departamento
+    mascara_filas = filtro_cascada("Departamento", 'DEPARTAMENTO', mascara_filas)
+
+    # 3. Provincia
+    mascara_filas = filtro_cascada("Provincia", 'PROVINCIA', mascara_filas)
+
+    # 4. Distrito
+    mascara_filas = filtro_cascada("Distrito", 'DISTRITO', mascara_filas)
+
+    # C. Filtros de Búsqueda Dinámica
+    st.sidebar.subheader("🔍 Búsqueda Específica")
+
+    # 1. Filtro por CAI o Descripción (se muestra CAI + Descripción, se filtra por el código CAI)
+    mascara_filas = filtro_busqueda("Seleccionar CAI / Producto:", 'CAI_Clean', mascara_filas)
+
+    # 2. Filtro por Cliente (busca por nombre o código de cliente)
+    mascara_filas = filtro_busqueda("Seleccionar Cliente:", 'CLIENTE', mascara_filas)
+
+    # Las filas finales salen de la misma máscara del índice que armó las opciones (no se vuelven a evaluar
+    # los filtros); sin filtros se usa el cubo mensual compartido tal cual, sin copia
+    df_so_trend = motor_consultas["filtrar"](df_mes, selecciones, mascara=mascara_filas)
+    registro_filtros["filas"] = len(df_so_trend)
+
+st.sidebar.markdown(f"--- \n**Registros:** {int(df_so_trend['N_REG'].sum())}")
+st.sidebar.caption(f"🧊 Cubo: {len(df_mes):,} filas por mes ({len(df_cubo):,} por día) de {len(df_unificado):,} transacciones")
+if ds.listar_particiones():
+    st.sidebar.caption(f"📂 Sell Out en {len(ds.leer_manifiesto())} particiones ({os.path.basename(ds.CARPETA_PARTICIONES)}/)")
+if "compactacion" in df_unificado.attrs:
+    m = df_unificado.attrs["compactacion"]
+    st.sidebar.caption(
+        f"💾 Memoria tabla: {m['mb_antes']:.1f} MB ➝ {m['mb_despues']:.1f} MB · "
+        f"Agrupación: {m['groupby_ms_antes']:.0f} ms ➝ {m['groupby_ms_despues']:.0f} ms"
+    )
 
 # --------------------------------------------------------------------------
-# 6. VISUALIZACIÓN
+# 5. VISUALIZACIÓN
 # --------------------------------------------------------------------------
+TITULOS_MOVIMIENTOS = {'🟢': "Suben", '🔴': "Bajan", '💀': "Perdidos", '✨': "Nuevos"}
+
+# Desglose del gráfico de evolución ➝ columna del cubo (None = una sola serie con el total)
+DESGLOSES_GRAFICO = {"Total": None, "Cliente": "CLIENTE", "CAI / Producto": "CAI_Clean",
+                     "Account Manager": "ACCOUNT MANAGER", "Departamento": "DEPARTAMENTO",
+                     "Provincia": "PROVINCIA", "Distrito": "DISTRITO"}
+
+def figura_evolucion(df_series, etiquetas):
+    """Líneas WebGL (Scattergl), una por serie, ya submuestreadas en el servidor si son muchas o muy largas.
+
+    Los meses viajan como 'AAAA-MM' (el eje los sigue leyendo como fechas) para achicar el payload.
+    """
+    fig = go.Figure()
+    for nombre, (fechas, valores) in ds.submuestrear_series(df_series).items():
+        fig.add_trace(go.Scattergl(
+            x=fechas.strftime("%Y-%m"), y=valores, mode="lines+markers", name=str(etiquetas.get(nombre, nombre))[:45],
+            hovertemplate="%{x|%b-%Y}: %{y:,.0f}",
+        ))
+    fig.update_layout(height=420, margin=dict(l=10, r=10, t=30, b=10), hovermode="x unified",
+                      legend=dict(orientation="h", y=-0.15), yaxis_title="Cantidad")
+    return fig
+
+@st.fragment(run_every=2)
+def esperar_exportacion(id_exportacion):
+    """Se refresca sola (solo este bloque) mientras el archivo se escribe; al terminar recarga la página."""
+    estado = obtener_exportaciones().estado(id_exportacion)
+    if estado is None or estado["listo"] or estado["error"]:
+        st.rerun()
+    st.info("⏳ Preparando el archivo en segundo plano, puedes seguir usando el tablero...")
+
+def leer_exportacion(path):
+    with open(path, "rb") as archivo:
+        return archivo.read()
+
+def mostrar_exportacion(id_exportacion):
+    """Estado de la exportación de la sesión y, cuando está lista, el botón de descarga."""
+    estado = obtener_exportaciones().estado(id_exportacion)
+    if estado is None:
+        st.session_state.pop("exportacion", None)
+    elif estado["error"]:
+        st.error(f"❌ No se pudo exportar: {estado['error']}")
+    elif not estado["listo"]:
+        esperar_exportacion(id_exportacion)
+    else:
+        st.success(f"✅ {estado['nombre']}: {estado['filas']:,} filas en {estado['segundos']:.1f} s")
+        # Con una función Streamlit lee el archivo recién al hacer clic (en otro hilo), no en cada rerun
+        path = estado["path"]
+        st.download_button(f"📥 Descargar {estado['nombre']}", lambda: leer_exportacion(path), file_name=estado["nombre"],
+                           mime=estado["tipo"], on_click="ignore")
+
+def grupos_seleccionados(respuesta, nivel_1):
+    """Claves de primer nivel marcadas en la grilla (st_aggrid devuelve DataFrame, lista o None según versión)."""
+    seleccion = respuesta.selected_rows if hasattr(respuesta, "selected_rows") else respuesta.get("selected_rows")
+    if seleccion is None:
+        return set()
+    filas = seleccion.to_dict("records") if isinstance(seleccion, pd.DataFrame) else list(seleccion)
+    return {str(f[nivel_1]) for f in filas if f.get(nivel_1) is not None and ds.SEPARADOR_RUTA not in str(f.get('RUTA', ''))}
+
 if df_so_trend.empty:
     st.warning("⚠️ No hay datos para mostrar con los filtros seleccionados.")
 else:
@@ -372,64 +305,73 @@ else:
         col_view, col_info = st.columns([2, 3])
         with col_view:
             vista_jerarquia = st.radio("📂 Orden del Árbol:", ["Clientes ➝ Productos", "Productos ➝ Clientes"], horizontal=True)
+            ventanas_sel = st.multiselect("⏱️ Periodos móviles:", ds.VENTANAS_DISPONIBLES, default=ds.VENTANAS_DEFAULT)
             fecha_max_so = df_so_trend['FECHA_DT'].max() if 'FECHA_DT' in df_so_trend.columns else pd.Timestamp.now()
         
         with col_info:
             st.info(f"📅 Datos analizados hasta: **{fecha_max_so.strftime('%d-%b-%Y')}**")
+            rango_sel = st.date_input("📆 Rango personalizado (opcional):", value=[], format="DD/MM/YYYY")
 
         # Columnas base para agrupación
         cols_base = ['CLIENTE', 'CAI_Clean']
         if 'DENOMINATION' in df_so_trend.columns: cols_base.append('DENOMINATION')
         if 'CLASIFICACIÓN DR' in df_so_trend.columns: cols_base.append('CLASIFICACIÓN DR')
 
-        df_calc = df_so_trend[cols_base + ['FECHA_DT', 'CANTIDAD']].copy()
-        
-        # --- CÁLCULO DE PERIODOS MÓVILES (6M, 1Y, 1.5Y) ---
-        ventanas_map = {"6M": 6, "1Y": 12, "1.5Y": 18}
-        for label, meses in ventanas_map.items():
-            f_ini_act = fecha_max_so - pd.DateOffset(months=meses)
-            f_ini_prev = f_ini_act - pd.DateOffset(months=meses)
-            
-            mask_act = (df_calc['FECHA_DT'] > f_ini_act) & (df_calc['FECHA_DT'] <= fecha_max_so)
-            df_calc[f'Q_Act_{label}'] = np.where(mask_act, df_calc['CANTIDAD'], 0)
-            
-            mask_prev = (df_calc['FECHA_DT'] > f_ini_prev) & (df_calc['FECHA_DT'] <= f_ini_act)
-            df_calc[f'Q_Prev_{label}'] = np.where(mask_prev, df_calc['CANTIDAD'], 0)
-
-        # --- CÁLCULO DE TOTALES HISTÓRICOS (2022-2025) ---
-        for anio in [2022, 2023, 2024, 2025]:
-            df_calc[f'Total {anio}'] = np.where(df_calc['FECHA_DT'].dt.year == anio, df_calc['CANTIDAD'], 0)
-
-        # Agrupación Final
-        df_final_grid = df_calc.groupby(cols_base).sum(numeric_only=True).reset_index()
-
-        # Añadir Fecha de Última Compra
-        df_dates = df_calc.groupby(cols_base)['FECHA_DT'].max().reset_index()
-        df_final_grid = pd.merge(df_final_grid, df_dates, on=cols_base, how='left')
-        df_final_grid['MAX_DATE_TS'] = df_final_grid['FECHA_DT'].apply(lambda x: int(x.timestamp() * 1000) if pd.notnull(x) else 0)
-
-        # Descripción de producto combinada
-        if 'DENOMINATION' in df_final_grid.columns:
-            df_final_grid['PRODUCTO_DESC'] = df_final_grid['CAI_Clean'].astype(str) + " | " + df_final_grid['DENOMINATION'].fillna("")
-        else:
-            df_final_grid['PRODUCTO_DESC'] = df_final_grid['CAI_Clean'].astype(str)
+        # Ventanas y años salen de la misma especificación que luego arma las columnas de AG-Grid
+        ventanas = [ds.resolver_ventana(label, fecha_max_so) for label in ds.VENTANAS_DISPONIBLES if label in ventanas_sel]
+        if len(rango_sel) == 2:
+            ventanas.append(ds.ventana_rango(*rango_sel))
+        anios = ds.anios_de_datos(df_mes['FECHA_DT']) if 'FECHA_DT' in df_mes.columns else []
+
+        # Cubo mensual filtrado, con el detalle diario solo en los meses que corta algún periodo (CANTIDAD en
+        # 64 bits). La grilla de una misma selección se comparte entre sesiones (LRU acotada, se descarta al
+        # cambiar los datos)
+        clave_grilla = ds.clave_grilla(huellas, selecciones, ventanas)
+        df_final_grid = ds.CACHE_GRILLAS.obtener(clave_grilla)
+        if df_final_grid is None:
+            df_final_grid = ds.CACHE_GRILLAS.guardar(
+                clave_grilla, ds.preparar_grid(motor_consultas["ventanas"](
+                    ds.filas_ventanas(df_so_trend, df_cubo, ventanas, selecciones, cols_base + ['CANTIDAD', 'FECHA_DT'],
+                                      filtrar=motor_consultas["filtrar"]),
+                    cols_base, ventanas, anios))
+            )
 
         # --- CONFIGURACIÓN DE AG-GRID ---
-        gb = GridOptionsBuilder.from_dataframe(df_final_grid)
-        col_defs = []
-
-        # 1. Jerarquía (Oculta columnas originales, usa el árbol)
         if vista_jerarquia == "Clientes ➝ Productos":
-            col_defs.append({"field": "CLIENTE", "rowGroup": True, "hide": True})
-            col_defs.append({"field": "PRODUCTO_DESC", "rowGroup": True, "hide": True})
+            nivel_1, nivel_2 = "CLIENTE", "PRODUCTO_DESC"
             header_arbol = "Jerarquía (Cliente ➝ CAI)"
         else:
-            col_defs.append({"field": "PRODUCTO_DESC", "rowGroup": True, "hide": True})
-            col_defs.append({"field": "CLIENTE", "rowGroup": True, "hide": True})
+            nivel_1, nivel_2 = "PRODUCTO_DESC", "CLIENTE"
             header_arbol = "Jerarquía (CAI ➝ Cliente)"
+
+        # Árbol por demanda: se envían solo los grupos de primer nivel; las hojas de un grupo viajan al marcarlo
+        with col_view:
+            carga_por_demanda = st.checkbox(
+                "⚡ Carga por demanda (marca un grupo para ver su detalle)",
+                value=len(df_final_grid) > ds.UMBRAL_HOJAS_ARBOL,
+            )
+        clave_expandidos = f"grupos_expandidos_{nivel_1}"
+        expandidos = st.session_state.get(clave_expandidos, set())
+
+        if carga_por_demanda:
+            df_grid_envio = ds.filas_arbol_por_demanda(df_final_grid, nivel_1, nivel_2, expandidos)
+        else:
+            # Copia liviana: AgGrid convierte las fechas a texto y agrega su columna de id sobre lo que recibe,
+            # y la grilla de la caché es compartida
+            df_grid_envio = df_final_grid.copy(deep=False)
+
+        gb = GridOptionsBuilder.from_dataframe(df_grid_envio)
+        col_defs = []
+
+        # 1. Jerarquía (Oculta columnas originales, usa el árbol)
+        if carga_por_demanda:
+            col_defs.append({"headerName": "Ítems", "field": "ITEMS", "pinned": "left", "width": 70, "type": "numericColumn"})
+        else:
+            col_defs.append({"field": nivel_1, "rowGroup": True, "hide": True})
+            col_defs.append({"field": nivel_2, "rowGroup": True, "hide": True})
         
         # 2. Ocultar Clasificación DR (Permanece filtrable pero no visible)
-        if 'CLASIFICACIÓN DR' in df_final_grid.columns:
+        if 'CLASIFICACIÓN DR' in df_grid_envio.columns:
              col_defs.append({"field": "CLASIFICACIÓN DR", "hide": True})
 
         # 3. Columna Ultima Compra (Renombrada y Limpia)
@@ -449,7 +391,7 @@ else:
         })
         
         # 4. Columnas de Totales Anuales (Histórico Real con Doble Fila)
-        for anio in [2025, 2024, 2023, 2022]:
+        for anio in sorted(anios, reverse=True):
             col_defs.append({
                 "headerName": f"{anio}", 
                 "field": f"Total {anio}", 
@@ -466,30 +408,45 @@ else:
             })
 
         # 5. Periodos Móviles con nombres Prev y Act
-        for label in ["6M", "1Y", "1.5Y"]:
-            col_prev, col_act = f'Q_Prev_{label}', f'Q_Act_{label}'
-            js_icon = f"""
-            function(params) {{
-                var data = params.node.group ? params.node.aggData : params.data;
-                if (!data) return '';
-                var prev = data['{col_prev}'] || 0;
-                var act = data['{col_act}'] || 0;
-                if (act == 0 && prev > 0) return '💀'; 
-                if (prev == 0 && act > 0) return '✨'; 
-                if (act > prev) return '🟢'; 
-                if (act < prev) return '🔴'; 
-                if (act == prev && act == 0) return '⚪'; 
-                return '🟡';
-            }}
-            """
+        # El estado (Trend_<ventana>) viene calculado del servidor, también en los grupos del árbol por demanda;
+        # se ordena del peor al mejor estado y se filtra por valor
+        js_orden_trend = f"""
+        function(a, b) {{
+            var orden = {json.dumps(ds.ESTADOS_TENDENCIA, ensure_ascii=False)};
+            return orden.indexOf(a) - orden.indexOf(b);
+        }}
+        """
+        for ventana in ventanas:
+            label = ventana["label"]
+            col_prev, col_act, col_trend = f'Q_Prev_{label}', f'Q_Act_{label}', f'Trend_{label}'
+            col_trend_def = {"headerName": "Trend", "field": col_trend, "colId": f"Icon_{label}", "width": 65,
+                             "comparator": JsCode(js_orden_trend), "filter": "agSetColumnFilter",
+                             "cellStyle": {"textAlign": "center", "fontSize": "16px"}}
+            if not carga_por_demanda:
+                # Los grupos que arma AG-Grid en el navegador no existen en el servidor: solo para ellos se
+                # aplican las mismas reglas que ds.clasificar_tendencia sobre las sumas del grupo
+                col_trend_def["valueGetter"] = JsCode(f"""
+                function(params) {{
+                    if (!params.node.group) return params.data ? params.data['{col_trend}'] : '';
+                    var data = params.node.aggData;
+                    if (!data) return '';
+                    var prev = data['{col_prev}'] || 0;
+                    var act = data['{col_act}'] || 0;
+                    if (act == 0 && prev > 0) return '💀';
+                    if (prev == 0 && act > 0) return '✨';
+                    if (act > prev) return '🟢';
+                    if (act < prev) return '🔴';
+                    if (act == prev && act == 0) return '⚪';
+                    return '🟡';
+                }}
+                """)
             col_defs.append({
-                "headerName": f"Periodo {label}",
+                "headerName": ventana["titulo"],
                 "children": [
                     {"headerName": "Prev", "field": col_prev, "width": 75, "aggFunc": "sum", "type": "numericColumn"},
                     {"headerName": "Act", "field": col_act, "width": 75, "aggFunc": "sum", "type": "numericColumn", 
                      "cellStyle": {"fontWeight": "bold", "backgroundColor": "#f0f2f6"}},
-                    {"headerName": "Trend", "colId": f"Icon_{label}", "width": 65, "valueGetter": JsCode(js_icon), 
-                     "cellStyle": {"textAlign": "center", "fontSize": "16px"}}
+                    col_trend_def,
                 ]
             })
 
@@ -498,6 +455,19 @@ else:
             suppressAggFuncInHeader=True,  # <--- ESTO ELIMINA EL "SUM", "MAX", ETC.
             suppressSumAggregationInHeader=True
         )
+        if carga_por_demanda:
+            # Solo los grupos de primer nivel se pueden marcar; los ya abiertos llegan marcados y desplegados
+            n_grupos = int((~df_grid_envio['RUTA'].str.contains(ds.SEPARADOR_RUTA, regex=False)).sum())
+            gb.configure_selection(
+                "multiple", use_checkbox=True, suppressRowClickSelection=True,
+                pre_selected_rows=[i for i in range(n_grupos) if df_grid_envio.at[i, nivel_1] in expandidos],
+            )
+            gb.configure_grid_options(
+                treeData=True,
+                getDataPath=JsCode(f"function(data) {{ return data.RUTA.split('{ds.SEPARADOR_RUTA}'); }}"),
+                isRowSelectable=JsCode(f"function(node) {{ return !!node.data && node.data.RUTA.indexOf('{ds.SEPARADOR_RUTA}') === -1; }}"),
+                groupDefaultExpanded=1,
+            )
         
         gridOptions = gb.build()
         gridOptions['columnDefs'] = col_defs
@@ -517,12 +487,101 @@ else:
                 col["suppressSizeToFit"] = False
 
         # Renderizar
-        AgGrid(
-            df_final_grid, 
-            gridOptions=gridOptions, 
-            height=600, 
-            theme="streamlit", 
-            allow_unsafe_jscode=True, 
-            enable_enterprise_modules=True,
-            fit_columns_on_grid_load=True  # Ahora que no hay "SUM", se ajustará mucho mejor
-        )
+        with ds.medir_etapa("aggrid") as registro_grid:
+            registro_grid["filas"] = len(df_grid_envio)
+            respuesta_grid = AgGrid(
+                df_grid_envio, 
+                gridOptions=gridOptions, 
+                height=600, 
+                theme="streamlit", 
+                allow_unsafe_jscode=True, 
+                enable_enterprise_modules=True,
+                update_on=["selectionChanged"] if carga_por_demanda else [],
+                fit_columns_on_grid_load=True  # Ahora que no hay "SUM", se ajustará mucho mejor
+            )
+
+        # Abrir/cerrar grupos: se guardan los marcados y se vuelve a correr para traer (o soltar) sus hojas
+        if carga_por_demanda and respuesta_grid is not None:
+            nuevos_expandidos = grupos_seleccionados(respuesta_grid, nivel_1)
+            if nuevos_expandidos != expandidos:
+                st.session_state[clave_expandidos] = nuevos_expandidos
+                ds.cerrar_traza(filas_filtradas=len(df_so_trend), motor=nombre_motor, rerun="arbol")
+                st.rerun()
+
+    # Pares cliente-producto que más se movieron en un periodo, sobre la misma grilla de la selección
+    with st.expander("🏆 Principales Movimientos (Cliente × Producto)", expanded=False):
+        if not ventanas:
+            st.info("Elige al menos un periodo móvil para ver los movimientos.")
+        else:
+            titulos_ventana = {v["label"]: v["titulo"] for v in ventanas}
+            col_periodo, col_top = st.columns([3, 1])
+            with col_periodo:
+                label_mov = st.radio("⏱️ Periodo:", list(titulos_ventana), horizontal=True, format_func=titulos_ventana.get)
+            with col_top:
+                n_mov = st.number_input("🔢 Top:", min_value=1, max_value=500, value=ds.TOP_MOVIMIENTOS, step=5)
+            reportes = ds.reporte_movimientos(df_final_grid, label_mov, n_mov)
+            pestanas = st.tabs([f"{simbolo} {TITULOS_MOVIMIENTOS[simbolo]} ({total:,})" for simbolo, (_, total) in reportes.items()])
+            for pestana, (df_mov, _) in zip(pestanas, reportes.values()):
+                with pestana:
+                    st.dataframe(df_mov, hide_index=True, width="stretch")
+
+    # Descarga de la selección actual: la grilla (ordenada como el árbol) o las transacciones filtradas
+    with st.expander("📥 Exportar", expanded=False):
+        col_contenido, col_formato, col_preparar = st.columns([3, 1, 1])
+        with col_contenido:
+            contenido = st.radio("📄 Contenido:", ["Grilla de tendencias", "Transacciones filtradas"], horizontal=True)
+        with col_formato:
+            formato = st.selectbox("Formato:", list(ds.TIPOS_EXPORTACION))
+        with col_preparar:
+            if st.button("⚙️ Preparar archivo"):
+                if contenido == "Grilla de tendencias":
+                    id_exportacion = obtener_exportaciones().iniciar(
+                        df_final_grid, formato, "tendencias", nombre_hoja="Tendencias",
+                        columnas=ds.columnas_exportacion_grilla(df_final_grid, nivel_1, nivel_2),
+                        filas=ds.orden_jerarquico(df_final_grid, nivel_1, nivel_2),
+                    )
+                else:
+                    # Solo las posiciones de las filas: la tabla unificada compartida no se copia
+                    filas = np.flatnonzero(ds.mascara_selecciones(df_unificado, selecciones)) if selecciones else None
+                    id_exportacion = obtener_exportaciones().iniciar(
+                        df_unificado, formato, "transacciones", nombre_hoja="Transacciones", filas=filas,
+                    )
+                st.session_state["exportacion"] = id_exportacion
+        if "exportacion" in st.session_state:
+            mostrar_exportacion(st.session_state["exportacion"])
+
+    # Evolución mensual de la misma selección, desde el cubo por mes (no desde las transacciones)
+    with st.expander("📉 Evolución Mensual", expanded=True):
+        col_desglose, col_series = st.columns([3, 1])
+        with col_desglose:
+            desglose = st.radio("📊 Ver por:", list(DESGLOSES_GRAFICO), horizontal=True)
+        with col_series:
+            max_series = st.number_input("🔢 Series:", min_value=1, max_value=30, value=ds.SERIES_MAX,
+                                         disabled=DESGLOSES_GRAFICO[desglose] is None)
+        df_series = ds.series_mensuales(df_so_trend, None, DESGLOSES_GRAFICO[desglose], max_series)
+        with ds.medir_etapa("grafico_evolucion") as registro_grafico:
+            fig_evolucion = figura_evolucion(df_series, ds.etiquetas_busqueda(indice_filtros, DESGLOSES_GRAFICO[desglose]))
+            registro_grafico["series"] = len(fig_evolucion.data)
+        st.plotly_chart(fig_evolucion, width="stretch")
+
+# --------------------------------------------------------------------------
+# 6. PANEL DE RENDIMIENTO (OPT-IN CON ?admin=1 EN LA URL)
+# --------------------------------------------------------------------------
+traza = ds.cerrar_traza(filas_filtradas=len(df_so_trend), motor=nombre_motor)
+
+if st.query_params.get("admin") == "1":
+    with st.expander("🛠️ Rendimiento (admin)", expanded=False):
+        st.caption(f"Rerun {traza['id']} · {traza['total_ms']:.0f} ms en total · motor: {nombre_motor} · "
+                   f"log: {ds.ARCHIVO_METRICAS or 'desactivado'}")
+        col_rerun, col_cache = st.columns(2)
+        with col_rerun:
+            st.markdown("**⏱️ Este rerun**")
+            st.dataframe(pd.DataFrame(traza["etapas"]), hide_index=True)
+        with col_cache:
+            st.markdown("**🗄️ Cachés (desde que arrancó el servidor)**")
+            st.dataframe(ds.resumen_cache(), hide_index=True)
+            lru = ds.CACHE_GRILLAS.resumen()
+            st.caption(f"Caché de grillas: {lru['entradas']}/{lru['max_entradas']} entradas · "
+                       f"{lru['mb']:.1f}/{lru['max_mb']:.0f} MB · {lru['desalojos']} desalojos")
+        st.markdown("**📊 Latencia por etapa en todas las sesiones (ms)**")
+        st.dataframe(ds.percentiles_etapas([t for t in ds.leer_trazas() if t.get("origen") == "dashboard"]), hide_index=True)
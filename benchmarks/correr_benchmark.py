@@ -0,0 +1,236 @@
+"""Benchmark por etapas del pipeline de Sell Out (sin Streamlit).
+
+Corre sobre una carpeta con los tres archivos (ver generar_datos.py) y mide por separado cada etapa que
+recorre una visita al dashboard: lectura con detección de encabezado (en paralelo si hay varios núcleos),
+los dos cruces, la tabla unificada, los cubos diario y mensual, la cascada de filtros del sidebar, las ventanas
+móviles (sobre el cubo mensual con los meses de borde por día, y sobre el diario para comparar), el armado del payload de la grilla
+y las series del gráfico de evolución mensual.
+Por etapa guarda tiempo de reloj y RSS máximo del proceso hasta ese punto (con `--memoria`, además el pico
+de memoria de la etapa según tracemalloc, que a cambio infla los tiempos) y escribe todo a un JSON que se
+puede comparar con otra corrida.
+
+Uso:
+    python benchmarks/correr_benchmark.py --datos /tmp/sellout_1m --salida base.json
+    python benchmarks/correr_benchmark.py --datos /tmp/sellout_1m --salida nuevo.json --comparar base.json
+    python benchmarks/correr_benchmark.py --generar 1000000 --datos /tmp/sellout_1m --salida base.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np
+import pandas as pd
+
+import generar_datos
+
+# Filtros que se simulan en la cascada: se elige el valor más frecuente de cada uno
+FILTROS_SIMULADOS = ['Segmento LB', 'ACCOUNT MANAGER']
+# Claves de la grilla de tendencias, como en el monitor
+COLS_GRILLA = ['CLIENTE', 'CAI_Clean', 'DENOMINATION', 'CLASIFICACIÓN DR']
+
+
+def _rss_max_mb():
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+class Medidor:
+    """Cronómetro por etapa con pico de memoria; acumula los resultados en `etapas`."""
+
+    def __init__(self, memoria=False):
+        self.memoria = memoria
+        self.etapas = []
+
+    def medir(self, nombre, funcion, *args, **kwargs):
+        gc.collect()
+        if self.memoria:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        resultado = funcion(*args, **kwargs)
+        segundos = time.perf_counter() - t0
+        pico = None
+        if self.memoria:
+            pico = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+        registro = {"etapa": nombre, "segundos": round(segundos, 4), "pico_mb": pico and round(pico, 1),
+                    "rss_max_mb": round(_rss_max_mb(), 1)}
+        if isinstance(resultado, pd.DataFrame):
+            registro["filas"] = len(resultado)
+        elif isinstance(resultado, str):
+            registro["bytes"] = len(resultado.encode("utf-8"))
+        self.etapas.append(registro)
+        print(f"  {nombre:<22} {segundos:8.3f} s  RSS {registro['rss_max_mb']:8.1f} MB"
+              + (f"  pico {pico:8.1f} MB" if pico is not None else "")
+              + (f"  {registro['filas']:,} filas" if "filas" in registro else "")
+              + (f"  {registro['bytes']:,} bytes" if "bytes" in registro else ""))
+        return resultado
+
+
+def cascada_filtros(ds, indice, df_mes):
+    """Igual que el sidebar: opciones de cada filtro sobre la máscara vigente y selección del más frecuente."""
+    mascara = None
+    for col in ds.DIMENSIONES_FILTRO:
+        if col not in indice:
+            continue
+        opciones = ds.opciones_disponibles(indice, col, mascara)
+        if col in FILTROS_SIMULADOS and opciones:
+            codigos = indice[col]["codigos"] if mascara is None else indice[col]["codigos"][mascara]
+            mas_frecuente = indice[col]["categorias"][np.bincount(codigos[codigos >= 0]).argmax()]
+            mascara = ds.aplicar_seleccion(indice, col, [mas_frecuente], mascara)
+    return df_mes if mascara is None else df_mes.take(np.flatnonzero(mascara))
+
+
+def ventanas_tendencia(ds, df_filas, df_mes, ventanas):
+    """Grilla de tendencias con los periodos por defecto y los totales anuales, como el monitor."""
+    cols_base = [c for c in COLS_GRILLA if c in df_filas.columns]
+    anios = ds.anios_de_datos(df_mes['FECHA_DT'])
+    return ds.calcular_ventanas(df_filas, cols_base, ventanas, anios)
+
+
+def payload_grilla(ds, df_grid):
+    """Columnas de AG-Grid y serialización a JSON (lo que viaja al navegador), por demanda si corresponde."""
+    df_grid = ds.preparar_grid(df_grid)
+    if len(df_grid) > ds.UMBRAL_HOJAS_ARBOL:
+        df_grid = ds.filas_arbol_por_demanda(df_grid, "CLIENTE", "PRODUCTO_DESC", set())
+    return df_grid.drop(columns=['FECHA_DT'], errors='ignore').to_json(orient="records")
+
+
+def payload_evolucion(ds, df_mes, selecciones):
+    """Series mensuales por cliente de la selección, submuestreadas como para el gráfico, en JSON."""
+    series = ds.submuestrear_series(ds.series_mensuales(df_mes, selecciones, "CLIENTE"))
+    return json.dumps({nombre: [fechas.strftime("%Y-%m").tolist(), valores.tolist()]
+                       for nombre, (fechas, valores) in series.items()})
+
+
+def correr(datos, memoria=False):
+    """Pipeline completo en frío (caché vacía) y la relectura en caliente de los artefactos."""
+    cache = tempfile.mkdtemp(prefix="cache_sellout_")
+    os.environ["SELLOUT_DATOS"] = os.path.abspath(datos)
+    os.environ["SELLOUT_CACHE"] = cache
+    import datos_sellout as ds
+
+    m = Medidor(memoria)
+    huellas = m.medir("huellas_fuentes", ds.huellas_fuentes)
+    # Con más de un núcleo las fuentes se normalizan acá en paralelo y las cargas siguientes leen el snapshot
+    m.medir("carga_paralela", ds.precargar_fuentes)
+    df_base = m.medir("carga_sell_out", ds.construir_base_ventas)
+    if df_base is None:
+        raise SystemExit(f"No hay archivo de Sell Out en {datos}")
+    m.medir("cruce_zonas", ds.construir_columnas_zona, df_base, huellas[0], huellas[1])
+    m.medir("cruce_productos", ds.construir_columnas_producto, df_base, huellas[0], huellas[2])
+    del df_base
+    df_unificado = m.medir("tabla_unificada", ds.construir_tabla_unificada, *huellas)
+    df_cubo = m.medir("cubo", ds.construir_cubo, *huellas, df_unificado=df_unificado)
+    df_mes = m.medir("cubo_mensual", ds.construir_cubo_mensual, *huellas, df_cubo=df_cubo)
+    indice = m.medir("indice_filtros", ds.construir_indice_filtros, df_mes)
+    df_filtrado = m.medir("cascada_filtros", cascada_filtros, ds, indice, df_mes)
+    selecciones = {col: [str(df_filtrado[col].mode().iloc[0])] for col in FILTROS_SIMULADOS if col in df_filtrado.columns}
+    ventanas = [ds.resolver_ventana(label, df_filtrado['FECHA_DT'].max()) for label in ds.VENTANAS_DEFAULT]
+    # Cubo mensual con el detalle diario solo en los meses de borde, contra el cubo diario con los mismos filtros
+    df_filas = m.medir("filas_ventanas", ds.filas_ventanas, df_filtrado, df_cubo, ventanas, selecciones,
+                       COLS_GRILLA + ['CANTIDAD', 'FECHA_DT'])
+    df_dia_filtrado = df_cubo[ds.mascara_selecciones(df_cubo, selecciones)]
+    m.medir("ventanas_cubo_diario", ventanas_tendencia, ds, df_dia_filtrado, df_mes, ventanas)
+    df_grid = m.medir("ventanas", ventanas_tendencia, ds, df_filas, df_mes, ventanas)
+    filas = {"filas_cubo_diario": len(df_cubo), "filas_cubo_mensual": len(df_mes),
+             "filas_ventanas_diario": len(df_dia_filtrado), "filas_ventanas": len(df_filas)}
+    print(f"  Cubo: {len(df_cubo):,} filas por día ➝ {len(df_mes):,} por mes · ventanas de la selección sobre "
+          f"{len(df_filas):,} filas (antes {len(df_dia_filtrado):,})")
+    del df_dia_filtrado
+    payload = m.medir("payload_grilla", payload_grilla, ds, df_grid)
+    # preparar_grid ya dejó las columnas Trend_ en df_grid
+    m.medir("movimientos", ds.reporte_movimientos, df_grid, ds.VENTANAS_DEFAULT[0])
+    m.medir("payload_evolucion", payload_evolucion, ds, df_mes, selecciones)
+    # Exportaciones por lotes: con --memoria el pico no debería crecer con el tamaño del archivo
+    m.medir("exportar_grilla_xlsx", ds.exportar, df_grid, "xlsx", os.path.join(cache, "grilla.xlsx"),
+            columnas=ds.columnas_exportacion_grilla(df_grid, "CLIENTE", "PRODUCTO_DESC"))
+    m.medir("exportar_filas_csv", ds.exportar, df_unificado, "csv", os.path.join(cache, "filas.csv"),
+            filas=np.flatnonzero(ds.mascara_selecciones(df_unificado, selecciones)))
+    del df_unificado, df_cubo, df_mes
+
+    # Segunda visita: todo sale de los artefactos en disco
+    m.medir("tabla_unificada_disco", ds.construir_tabla_unificada, *huellas)
+    m.medir("cubo_disco", ds.construir_cubo, *huellas)
+    m.medir("cubo_mensual_disco", ds.construir_cubo_mensual, *huellas)
+
+    return {
+        "filas_sell_out": int(len(ds.construir_tabla_unificada(*huellas))),
+        "payload_bytes": len(payload.encode("utf-8")),
+        **filas,
+        "etapas": m.etapas,
+    }
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def comparar(actual, base):
+    """Tabla de diferencias por etapa contra una corrida anterior (positivo = más lento)."""
+    previas = {e["etapa"]: e for e in base["etapas"]}
+    print(f"\n{'etapa':<22} {'base s':>9} {'nuevo s':>9} {'Δ %':>7}   {'base MB':>8} {'nuevo MB':>8}")
+    # MB = pico de la etapa si ambas corridas usaron --memoria, si no RSS máximo del proceso
+    clave_mb = "pico_mb" if actual["etapas"][0]["pico_mb"] is not None and base["etapas"][0]["pico_mb"] is not None else "rss_max_mb"
+    for e in actual["etapas"]:
+        p = previas.get(e["etapa"])
+        if not p:
+            continue
+        delta = (e["segundos"] / p["segundos"] - 1) * 100 if p["segundos"] else float("nan")
+        print(f"{e['etapa']:<22} {p['segundos']:9.3f} {e['segundos']:9.3f} {delta:+7.1f}   "
+              f"{p[clave_mb]:8.1f} {e[clave_mb]:8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark por etapas del pipeline de Sell Out.")
+    parser.add_argument("--datos", required=True, help="carpeta con Sell Out, Zonas y maestro CAI")
+    parser.add_argument("--salida", default="benchmark.json")
+    parser.add_argument("--generar", type=int, default=None, metavar="FILAS",
+                        help="genera datos sintéticos de este tamaño en --datos antes de medir")
+    parser.add_argument("--memoria", action="store_true",
+                        help="mide el pico de memoria de cada etapa con tracemalloc (más lento)")
+    parser.add_argument("--comparar", default=None, metavar="JSON", help="corrida anterior para comparar")
+    args = parser.parse_args(argv)
+
+    if args.generar:
+        # En otro proceso, para que el RSS máximo medido sea solo del pipeline
+        subprocess.run([sys.executable, generar_datos.__file__, "--filas", str(args.generar), "--destino", args.datos],
+                       check=True)
+    print(f"Benchmark sobre {args.datos}")
+    resultado = correr(args.datos, memoria=args.memoria)
+    resultado.update({
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _commit_actual(),
+        "datos": os.path.abspath(args.datos),
+        "filas_generadas": args.generar,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "maquina": platform.machine(),
+    })
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"Resultados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(resultado, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
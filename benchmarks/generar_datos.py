@@ -0,0 +1,217 @@
+"""Generador de datos sintéticos de Sell Out, Zonas y maestro CAI para los benchmarks.
+
+Reproduce las mañas de los archivos reales que los loaders ya manejan: filas de título antes del
+encabezado, `ANO`/`MES` en lugar de `FECHA`, `AM` o `ACOOUNT MANAGER` en Zonas, clientes repetidos con
+y sin punto final y códigos de cliente duplicados en el maestro de zonas. La misma semilla da los mismos
+archivos.
+
+Uso:
+    python benchmarks/generar_datos.py --filas 1000000 --destino /tmp/sellout_1m
+    python benchmarks/generar_datos.py --filas 50000 --formato xlsx --fecha anio_mes --am "ACOOUNT MANAGER"
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+import openpyxl
+
+NOMBRE_SELL_OUT = "SO_Sintetico"
+NOMBRE_ZONAS = "Sell Out Zonas.xlsx"
+NOMBRE_CAI = "CAI historico 2.xlsx"
+LOTE_ESCRITURA = 500_000
+
+# Proporciones del archivo real (12.7k filas: ~580 clientes, ~200 CAI vendidos de un catálogo de ~3.6k)
+SEGMENTOS = ["OHT", "AGRO", "TRUCK"]
+MARCAS = ["MICHELIN", "BFGOODRICH", "TIGAR", "KORMORAN", "UNIROYAL"]
+MACRO_MACHINES = [f"MM{i:02d}" for i in range(23)]
+CLASIFICACIONES = [f"CAT{i}" for i in range(1, 23)] + [np.nan]
+DEPARTAMENTOS = 18
+PROVINCIAS_POR_DEPTO = 3
+DISTRITOS_POR_PROVINCIA = 3
+MANAGERS = 9
+DESCRIPCIONES = ["XZH2 R TL", "OMNIBIB TL", "XHA2 L3 TL *", "POWER G2 PR16", "XLD D2 A TL *", "XTRA LOAD GRIP"]
+
+
+def cardinalidades(filas, clientes=None, productos=None):
+    """Clientes y CAI vendidos que crecen con la raíz del volumen, con el archivo real como piso."""
+    escala = max(filas / 12_756, 1.0)
+    clientes = clientes or int(580 * np.sqrt(escala))
+    productos = productos or int(200 * np.sqrt(escala))
+    catalogo = max(productos * 18, 3_600)
+    return clientes, productos, catalogo
+
+
+def _pesos_zipf(n, rng, s=1.1):
+    """Popularidad desigual (pocos clientes/productos concentran la mayor parte de las ventas)."""
+    pesos = 1.0 / np.arange(1, n + 1) ** s
+    rng.shuffle(pesos)
+    return pesos / pesos.sum()
+
+
+def generar_catalogo(catalogo, rng):
+    """Maestro CAI: códigos únicos con segmento, marca, máquina, clasificación y columnas de relleno."""
+    cais = rng.choice(np.arange(100_000, 100_000 + catalogo * 10), size=catalogo, replace=False)
+    medidas = rng.choice(["13R22.5", "26.5 R 25", "29.5 R 25", "580/70 R38", "14.00 - 24"], size=catalogo)
+    dibujos = rng.choice(DESCRIPCIONES, size=catalogo)
+    return pd.DataFrame({
+        "CAI": cais,
+        "DENOMINATION": [f"{m} {d} {c}" for m, d, c in zip(medidas, dibujos, cais)],
+        "Grupo CAI": rng.choice(["OUTROS", "RADIAL", "BIAS"], size=catalogo),
+        "BS": rng.choice([f"CAT{i}" for i in range(16)], size=catalogo),
+        "MACRO_ MACHINE": rng.choice(MACRO_MACHINES, size=catalogo),
+        "Segmento LB": rng.choice(SEGMENTOS, size=catalogo),
+        "MARCA": rng.choice(MARCAS, size=catalogo, p=[0.6, 0.15, 0.1, 0.1, 0.05]),
+        "Peso ASP": rng.uniform(20, 400, size=catalogo).round(3),
+        "Clasificación DR": rng.choice(np.array(CLASIFICACIONES, dtype=object), size=catalogo),
+    })
+
+
+def generar_clientes(clientes, rng):
+    """Clientes con RUC de 11 dígitos, nombre y ubicación (departamento ➝ provincia ➝ distrito)."""
+    cods = rng.choice(np.arange(20_100_000_000, 20_600_000_000), size=clientes, replace=False)
+    depto = rng.integers(0, DEPARTAMENTOS, size=clientes)
+    prov = depto * PROVINCIAS_POR_DEPTO + rng.integers(0, PROVINCIAS_POR_DEPTO, size=clientes)
+    dist = prov * DISTRITOS_POR_PROVINCIA + rng.integers(0, DISTRITOS_POR_PROVINCIA, size=clientes)
+    sufijos = rng.choice(["S.A.", "S.A.C.", "SAC", "E.I.R.L.", "S.R.L"], size=clientes)
+    return pd.DataFrame({
+        "COD.CLIENTE": cods,
+        "NOMBRE CLIENTE": [f"CLIENTE {i:06d} {s}" for i, s in enumerate(sufijos)],
+        "AM": [f"MANAGER {i % MANAGERS}" for i in rng.integers(0, MANAGERS, size=clientes)],
+        "Departamento": [f"DEPTO {d}" for d in depto],
+        "Provincia": [f"PROV {p}" for p in prov],
+        "Distrito": [f"DIST {d}" for d in dist],
+    })
+
+
+def escribir_maestros(destino, df_catalogo, df_clientes, cais_vendidos, am, rng):
+    """Sell Out Zonas (una fila por cliente × CAI, como el real) y el maestro CAI en Excel."""
+    # Zonas repite cada cliente con varios CAI: el loader se queda con el primero por COD.CLIENTE
+    repeticiones = rng.integers(1, 4, size=len(df_clientes))
+    df_zonas = df_clientes.loc[df_clientes.index.repeat(repeticiones)].reset_index(drop=True)
+    df_zonas.insert(0, "CAI", rng.choice(cais_vendidos, size=len(df_zonas)))
+    # Algunos clientes sin zona asignada (salen como "SIN ASIGNAR")
+    df_zonas = df_zonas[rng.random(len(df_zonas)) > 0.03]
+    df_zonas = df_zonas.rename(columns={"AM": am})
+
+    with pd.ExcelWriter(os.path.join(destino, NOMBRE_ZONAS), engine="openpyxl") as xw:
+        df_zonas.to_excel(xw, sheet_name="Sell Out", index=False)
+    with pd.ExcelWriter(os.path.join(destino, NOMBRE_CAI), engine="openpyxl") as xw:
+        df_catalogo.to_excel(xw, sheet_name="Base CAI", index=False)
+
+
+def lotes_sell_out(filas, df_catalogo, df_clientes, cais_vendidos, fecha, rng, anio_fin=2025, anios=6):
+    """Filas de Sell Out en lotes (DataFrames) para no tener los 10M en memoria a la vez."""
+    desc = pd.Series(df_catalogo["DENOMINATION"].to_numpy(), index=df_catalogo["CAI"])
+    p_clientes = _pesos_zipf(len(df_clientes), rng)
+    p_productos = _pesos_zipf(len(cais_vendidos), rng)
+    inicio = np.datetime64(f"{anio_fin - anios + 1}-01-01")
+    dias = (np.datetime64(f"{anio_fin}-12-31") - inicio).astype(int)
+
+    emitidas = 0
+    while emitidas < filas:
+        n = min(LOTE_ESCRITURA, filas - emitidas)
+        idx_cli = rng.choice(len(df_clientes), size=n, p=p_clientes)
+        cai = cais_vendidos[rng.choice(len(cais_vendidos), size=n, p=p_productos)]
+        fechas = inicio + rng.integers(0, dias + 1, size=n).astype("timedelta64[D]")
+        cantidad = np.maximum(rng.geometric(0.3, size=n), 1) * rng.choice([1, 2], size=n)
+        # ~1% de notas de crédito (cantidades negativas)
+        cantidad = np.where(rng.random(n) < 0.01, -cantidad, cantidad)
+
+        nombres = df_clientes["NOMBRE CLIENTE"].to_numpy()[idx_cli]
+        # El mismo cliente aparece con y sin punto final (el loader lo quita)
+        nombres = np.where(rng.random(n) < 0.5, np.char.add(nombres.astype(str), "."), nombres)
+
+        lote = {
+            "CAI": cai,
+            "DESCRIPCIÓN": pd.Series(cai).map(desc).fillna("SIN DESCRIPCION"),
+            "CANTIDAD": cantidad,
+            "VALOR VENTA": (cantidad * rng.uniform(80, 2_500, size=n)).round(2),
+            "COD.CLIENTE": df_clientes["COD.CLIENTE"].to_numpy()[idx_cli],
+            "NOMBRE CLIENTE": nombres,
+        }
+        anio = fechas.astype("datetime64[Y]").astype(int) + 1970
+        mes = fechas.astype("datetime64[M]").astype(int) % 12 + 1
+        if fecha == "fecha":
+            lote.update({"FECHA": pd.to_datetime(fechas), "MES": mes, "AÑO": anio})
+        else:
+            lote.update({"ANO": anio, "MES": mes})
+        lote.update({"TD": "FT", "MONEDA": "DOLARES AMERICANOS"})
+        emitidas += n
+        yield pd.DataFrame(lote)
+
+
+# Filas de título antes del encabezado, como en el export de la tabla dinámica
+TITULO = ["Detalles para Suma de CANTIDAD - reporte sintético"]
+
+
+def escribir_sell_out(path, lotes, formato):
+    """CSV en streaming o Excel en modo write_only, con las filas de título antes del encabezado."""
+    if formato == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            escritor = csv.writer(f)
+            escritor.writerow(TITULO)
+            escritor.writerow([])
+            primero = True
+            for lote in lotes:
+                lote.to_csv(f, header=primero, index=False, date_format="%Y-%m-%d")
+                primero = False
+        return
+
+    wb = openpyxl.Workbook(write_only=True)
+    hoja = wb.create_sheet("Sell Out")
+    hoja.append(TITULO)
+    hoja.append([])
+    primero = True
+    for lote in lotes:
+        if primero:
+            hoja.append(list(lote.columns))
+            primero = False
+        for fila in lote.itertuples(index=False):
+            hoja.append([v.to_pydatetime() if isinstance(v, pd.Timestamp) else v for v in fila])
+    wb.save(path)
+
+
+def generar(destino, filas, formato="csv", fecha="fecha", am="AM", semilla=7, clientes=None, productos=None):
+    """Escribe los tres archivos en `destino` y devuelve un resumen de lo generado."""
+    os.makedirs(destino, exist_ok=True)
+    rng = np.random.default_rng(semilla)
+    n_clientes, n_productos, n_catalogo = cardinalidades(filas, clientes, productos)
+
+    df_catalogo = generar_catalogo(n_catalogo, rng)
+    df_clientes = generar_clientes(n_clientes, rng)
+    cais_vendidos = rng.choice(df_catalogo["CAI"].to_numpy(), size=n_productos, replace=False)
+    # Unos pocos CAI vendidos que no están en el catálogo (salen como "OTROS")
+    cais_vendidos[: max(1, n_productos // 50)] += 7
+
+    escribir_maestros(destino, df_catalogo, df_clientes, cais_vendidos, am, rng)
+    path_so = os.path.join(destino, f"{NOMBRE_SELL_OUT}.{formato}")
+    escribir_sell_out(path_so, lotes_sell_out(filas, df_catalogo, df_clientes, cais_vendidos, fecha, rng), formato)
+
+    return {"destino": destino, "filas": filas, "formato": formato, "fecha": fecha, "am": am, "semilla": semilla,
+            "clientes": n_clientes, "productos": n_productos, "catalogo": n_catalogo}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera archivos sintéticos de Sell Out para benchmarks.")
+    parser.add_argument("--filas", type=int, default=100_000)
+    parser.add_argument("--destino", default="datos_benchmark")
+    parser.add_argument("--formato", choices=["csv", "xlsx"], default="csv",
+                        help="formato del Sell Out (xlsx es lento de escribir por encima de ~500k filas)")
+    parser.add_argument("--fecha", choices=["fecha", "anio_mes"], default="fecha",
+                        help="columna FECHA (con MES/AÑO) o solo ANO/MES")
+    parser.add_argument("--am", choices=["AM", "ACOOUNT MANAGER"], default="AM",
+                        help="nombre de la columna de manager en Zonas")
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--clientes", type=int, default=None)
+    parser.add_argument("--productos", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    resumen = generar(args.destino, args.filas, args.formato, args.fecha, args.am, args.semilla,
+                      args.clientes, args.productos)
+    print(resumen)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Memoria por sesión del dashboard con muchos usuarios conectados a la vez.
+
+Levanta N sesiones de Streamlit en el mismo proceso (AppTest, sin navegador), cada una entra con la clave y
+filtra por un Account Manager distinto, y las deja vivas a la vez. Se abren una tras otra porque AppTest no
+admite correr en varios hilos; para la memoria lo que cuenta es cuántas siguen conectadas.
+
+La tabla unificada, el cubo y el índice de filtros se cargan una sola vez por proceso (st.cache_resource +
+Arrow mapeado de solo lectura), así que lo que crece con N es solo el estado propio de cada sesión: la
+selección filtrada, la grilla y los widgets.
+
+Informa el RSS con una sesión, con N, y el costo marginal por sesión. AppTest además guarda el árbol de
+elementos de cada sesión (en un servidor real eso viaja al navegador), así que la cifra es una cota superior.
+Con --limite-mb sale con código 1 si el costo por sesión lo supera.
+
+Uso:
+    python benchmarks/memoria_sesiones.py --usuarios 50
+    python benchmarks/memoria_sesiones.py --datos /tmp/sellout_1m --usuarios 50 --limite-mb 5
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CLAVE = "XE07089"
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+def abrir_sesion(AppTest, n):
+    """Una sesión: login y un filtro de Account Manager (rota entre las opciones para variar la selección)."""
+    at = AppTest.from_file(os.path.join(RAIZ, "Dashboard_SellOut.py"), default_timeout=600)
+    at.run()
+    at.sidebar.text_input[0].input(CLAVE).run()
+    filtro = next((m for m in at.sidebar.multiselect if m.label == "Account Manager"), None)
+    if filtro is not None and filtro.options:
+        filtro.select(filtro.options[n % len(filtro.options)]).run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return at
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memoria por sesión con N usuarios concurrentes.")
+    parser.add_argument("--datos", default=None, help="carpeta con las fuentes (por defecto la raíz del repo)")
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--limite-mb", type=float, default=None, help="falla si el costo por sesión lo supera")
+    args = parser.parse_args(argv)
+
+    if args.datos:
+        os.environ["SELLOUT_DATOS"] = os.path.abspath(args.datos)
+        os.environ.setdefault("SELLOUT_CACHE", tempfile.mkdtemp(prefix="cache_sellout_"))
+    os.environ.setdefault("SELLOUT_METRICAS", "")
+    from streamlit.testing.v1 import AppTest
+    import datos_sellout as ds
+
+    # La primera sesión paga la carga compartida; el resto solo su propio estado
+    sesiones = [abrir_sesion(AppTest, 0)]
+    gc.collect()
+    rss_una = _rss_mb()
+
+    t0 = time.perf_counter()
+    sesiones += [abrir_sesion(AppTest, n) for n in range(1, args.usuarios)]
+    segundos = time.perf_counter() - t0
+    gc.collect()
+    rss_n = _rss_mb()
+
+    por_sesion = (rss_n - rss_una) / max(args.usuarios - 1, 1)
+    cargas = {k: v["fallos"] for k, v in ds.resumen_cache().set_index("cache").to_dict("index").items()
+              if k.startswith("memoria:")}
+    print(f"Sesiones vivas: {len(sesiones)} ({segundos / max(args.usuarios - 1, 1) * 1000:.0f} ms por sesión)")
+    print(f"RSS con 1 sesión:  {rss_una:8.1f} MB")
+    print(f"RSS con {args.usuarios} sesiones: {rss_n:8.1f} MB")
+    print(f"Costo por sesión:  {por_sesion:8.2f} MB")
+    print(f"Cargas de la caché compartida (deben ser 1): {cargas}")
+
+    if args.limite_mb is not None and por_sesion > args.limite_mb:
+        print(f"FALLA: {por_sesion:.2f} MB por sesión supera el límite de {args.limite_mb} MB")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
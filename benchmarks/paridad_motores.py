@@ -0,0 +1,129 @@
+"""Paridad y tiempos de los motores de consulta (pandas / DuckDB / Polars) sobre el mismo cubo mensual.
+
+Para varios escenarios de filtros compara contra la referencia en pandas:
+  1. las filas que devuelve `filtrar` evaluando las selecciones (como en los meses de borde), que deben
+     coincidir con las que da pasándole la máscara del índice del sidebar (como en el dashboard), y
+  2. la grilla de tendencias (`df_final_grid`): mismas filas, orden, columnas y valores, y la misma que da
+     calcular las ventanas sobre el cubo diario (el mensual solo baja al día en los meses de borde).
+Sale con código 1 si algún motor difiere. Sin --datos usa los archivos de la raíz del repo.
+
+Uso:
+    python benchmarks/paridad_motores.py
+    python benchmarks/paridad_motores.py --datos /tmp/sellout_1m --repeticiones 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np
+import pandas as pd
+
+
+def escenarios(ds, indice):
+    """Sin filtros, un filtro de producto, uno de zona combinado, y una búsqueda por CAI/cliente."""
+    def mas_frecuente(col, n=1):
+        dim = indice[col]
+        conteo = np.bincount(dim["codigos"][dim["codigos"] >= 0], minlength=len(dim["categorias"]))
+        return dim["categorias"][np.argsort(-conteo, kind='stable')[:n]].tolist()
+
+    casos = {"sin_filtros": {}}
+    if 'Segmento LB' in indice:
+        casos["segmento"] = {'Segmento LB': mas_frecuente('Segmento LB')}
+    if 'ACCOUNT MANAGER' in indice and 'DEPARTAMENTO' in indice:
+        casos["manager_y_departamento"] = {'ACCOUNT MANAGER': mas_frecuente('ACCOUNT MANAGER', 2),
+                                           'DEPARTAMENTO': mas_frecuente('DEPARTAMENTO', 3)}
+    if 'CAI_Clean' in indice and 'CLIENTE' in indice:
+        casos["cai_y_cliente"] = {'CAI_Clean': mas_frecuente('CAI_Clean', 20), 'CLIENTE': mas_frecuente('CLIENTE', 50)}
+    return casos
+
+
+def mascara_indice(ds, indice, selecciones):
+    mascara = None
+    for col, valores in selecciones.items():
+        mascara = ds.aplicar_seleccion(indice, col, valores, mascara)
+    return mascara
+
+
+def cronometrar(funcion, repeticiones, *args):
+    mejor, resultado = float("inf"), None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = funcion(*args)
+        mejor = min(mejor, time.perf_counter() - t0)
+    return resultado, mejor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Paridad de motores de consulta sobre el cubo de Sell Out.")
+    parser.add_argument("--datos", default=None, help="carpeta con las fuentes (por defecto la raíz del repo)")
+    parser.add_argument("--repeticiones", type=int, default=3, help="se informa el mejor tiempo de N corridas")
+    args = parser.parse_args(argv)
+
+    if args.datos:
+        os.environ["SELLOUT_DATOS"] = os.path.abspath(args.datos)
+        os.environ.setdefault("SELLOUT_CACHE", tempfile.mkdtemp(prefix="cache_sellout_"))
+    import datos_sellout as ds
+    import motores_sellout as ms
+
+    huellas = ds.huellas_fuentes()
+    df_dia = ds.construir_cubo(*huellas)
+    if df_dia is None:
+        raise SystemExit("No hay datos de Sell Out para comparar")
+    df_cubo = ds.construir_cubo_mensual(*huellas, df_cubo=df_dia)
+    indice = ds.construir_indice_filtros(df_cubo)
+
+    cols_base = [c for c in ['CLIENTE', 'CAI_Clean', 'DENOMINATION', 'CLASIFICACIÓN DR'] if c in df_cubo.columns]
+    anios = ds.anios_de_datos(df_cubo['FECHA_DT'])
+    motores = ms.motores_disponibles()
+    print(f"Cubo: {len(df_cubo):,} filas por mes ({len(df_dia):,} por día) · motores: {', '.join(motores)}")
+
+    fallas = 0
+    for nombre_caso, selecciones in escenarios(ds, indice).items():
+        mascara = mascara_indice(ds, indice, selecciones)
+        filas_indice = np.arange(len(df_cubo)) if mascara is None else np.flatnonzero(mascara)
+        referencia = None
+        print(f"\n{nombre_caso} ({len(filas_indice):,} filas)")
+
+        for nombre in motores:
+            motor = ms.obtener_motor(nombre)
+            df_filtrado, t_filtro = cronometrar(motor["filtrar"], args.repeticiones, df_cubo, selecciones)
+            fecha_max = df_filtrado['FECHA_DT'].max()
+            ventanas = [ds.resolver_ventana(label, fecha_max) for label in ds.VENTANAS_DISPONIBLES]
+            df_filas = ds.filas_ventanas(df_filtrado, df_dia, ventanas, selecciones)
+            df_grid, t_ventanas = cronometrar(motor["ventanas"], args.repeticiones, df_filas, cols_base, ventanas, anios)
+
+            errores = []
+            if not np.array_equal(df_filtrado.index.to_numpy(), filas_indice):
+                errores.append("filtrado distinto al índice del sidebar")
+            if not df_filtrado.equals(motor["filtrar"](df_cubo, selecciones, mascara=mascara)):
+                errores.append("filtrado con la máscara del índice distinto al de las selecciones")
+            if referencia is None:
+                referencia = df_grid
+                diaria = ds.calcular_ventanas(ms.filtrar_pandas(df_dia, selecciones), cols_base, ventanas, anios)
+                try:
+                    pd.testing.assert_frame_equal(df_grid, diaria, check_exact=False, rtol=1e-9)
+                except AssertionError as e:
+                    errores.append(f"grilla distinta a la del cubo diario: {str(e).splitlines()[0]}")
+            else:
+                try:
+                    pd.testing.assert_frame_equal(df_grid, referencia, check_exact=False, rtol=1e-9)
+                except AssertionError as e:
+                    errores.append(f"grilla distinta a pandas: {str(e).splitlines()[0]}")
+
+            estado = "OK" if not errores else "FALLA"
+            fallas += bool(errores)
+            print(f"  {nombre:<7} filtrar {t_filtro * 1000:8.1f} ms · ventanas {t_ventanas * 1000:8.1f} ms · "
+                  f"{len(df_grid):,} grupos · {estado}")
+            for error in errores:
+                print(f"      {error}")
+
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1958 @@
+"""Capa de datos del Dashboard de Sell Out (sin Streamlit).
+
+Lectura de las fuentes Excel/CSV, snapshots en disco, cruce con Zonas y el maestro CAI, cubo de ventas,
+índice de filtros y cálculo de ventanas de tendencia. Se puede importar desde scripts, pruebas o el
+precálculo (`precalcular.py`); el dashboard solo agrega caché de Streamlit e interfaz encima.
+
+Los avisos para el usuario (archivo faltante, error de lectura) no se muestran aquí: se agregan como
+tuplas (nivel, mensaje) a la lista `avisos` que recibe cada función, y quien llama decide cómo mostrarlos.
+"""
+import os
+import csv
+import json
+import itertools
+import re
+import time
+import hashlib
+import shutil
+import uuid
+import functools
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import OrderedDict, defaultdict, deque
+
+import numpy as np
+import pandas as pd
+import openpyxl
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.feather as feather
+
+# --------------------------------------------------------------------------
+# 1. RUTAS (SE PUEDEN CAMBIAR POR VARIABLES DE ENTORNO)
+# --------------------------------------------------------------------------
+CARPETA_DATOS = os.environ.get("SELLOUT_DATOS", os.path.dirname(os.path.abspath(__file__)))
+CARPETA_CACHE = os.environ.get("SELLOUT_CACHE", os.path.join(CARPETA_DATOS, ".cache_sellout"))
+# Carpeta con el Sell Out partido por periodos (un CSV/XLSX por mes, trimestre, etc.); si no existe o está
+# vacía se usa el archivo único de la raíz
+CARPETA_PARTICIONES = os.environ.get("SELLOUT_PARTICIONES", os.path.join(CARPETA_DATOS, "sell_out"))
+# Log de métricas en JSON lines (una línea por rerun/precálculo); vacío = no se escribe
+ARCHIVO_METRICAS = os.environ.get("SELLOUT_METRICAS", os.path.join(CARPETA_CACHE, "metricas.jsonl"))
+# Al pasar este tamaño el log se rota a "<archivo>.1" (se guarda solo una copia anterior)
+MAX_MB_METRICAS = float(os.environ.get("SELLOUT_METRICAS_MB", "20"))
+
+def _avisar(avisos, nivel, mensaje):
+    if avisos is not None:
+        avisos.append((nivel, mensaje))
+
+# --------------------------------------------------------------------------
+# 2. MÉTRICAS (TIEMPO POR ETAPA Y ACIERTOS DE CACHÉ)
+# --------------------------------------------------------------------------
+# Cada hilo (una sesión de Streamlit, un precálculo) arma su propia traza; los contadores de caché son
+# globales del proceso y se comparten entre sesiones.
+_local = threading.local()
+_lock_metricas = threading.Lock()
+CONTADORES_CACHE = defaultdict(lambda: {"aciertos": 0, "fallos": 0})
+
+def _rss_mb():
+    """Memoria residente actual del proceso en MB (None fuera de Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return None
+
+def iniciar_traza(origen):
+    """Abre la traza del hilo actual: a partir de aquí se acumulan etapas y accesos a caché."""
+    _local.traza = {"id": uuid.uuid4().hex[:12], "origen": origen, "inicio": time.time(), "etapas": [], "cache": []}
+    return _local.traza
+
+def traza_actual():
+    return getattr(_local, "traza", None)
+
+@contextlib.contextmanager
+def medir_etapa(nombre):
+    """Mide una etapa (ms y delta de memoria) en la traza actual; al registro se le puede agregar 'filas'."""
+    registro = {"etapa": nombre}
+    rss_antes, t0 = _rss_mb(), time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        rss_despues = _rss_mb()
+        if rss_antes is not None and rss_despues is not None:
+            registro["delta_mb"] = round(rss_despues - rss_antes, 1)
+        traza = traza_actual()
+        if traza is not None:
+            traza["etapas"].append(registro)
+
+def etapa(nombre):
+    """Decorador de medir_etapa; si la función devuelve un DataFrame anota sus filas."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir_etapa(nombre) as registro:
+                resultado = funcion(*args, **kwargs)
+                if isinstance(resultado, pd.DataFrame):
+                    registro["filas"] = len(resultado)
+                return resultado
+        return envoltura
+    return decorador
+
+def registrar_cache(capa, nombre, acierto):
+    """Cuenta un acceso a caché ('disco' = snapshots/artefactos, 'memoria' = caché del proceso)."""
+    clave = f"{capa}:{nombre}"
+    with _lock_metricas:
+        CONTADORES_CACHE[clave]["aciertos" if acierto else "fallos"] += 1
+    traza = traza_actual()
+    if traza is not None:
+        traza["cache"].append({"cache": clave, "acierto": acierto})
+
+def cerrar_traza(**extra):
+    """Cierra la traza del hilo, la agrega al log de métricas y la devuelve."""
+    traza = traza_actual()
+    if traza is None:
+        return None
+    _local.traza = None
+    traza["total_ms"] = round((time.time() - traza["inicio"]) * 1000, 2)
+    traza.update(extra)
+    if ARCHIVO_METRICAS:
+        try:
+            os.makedirs(os.path.dirname(ARCHIVO_METRICAS) or ".", exist_ok=True)
+            linea = json.dumps(traza, ensure_ascii=False, default=str)
+            with _lock_metricas:
+                with open(ARCHIVO_METRICAS, "a", encoding="utf-8") as f:
+                    f.write(linea + "\n")
+                    tamano = f.tell()
+                if tamano > MAX_MB_METRICAS * 1024 ** 2:
+                    os.replace(ARCHIVO_METRICAS, f"{ARCHIVO_METRICAS}.1")
+        except OSError:
+            pass
+    return traza
+
+def _ultimas_lineas(path, cantidad, bloque=64 * 1024):
+    """Las últimas `cantidad` líneas de un archivo, leyendo bloques desde el final (no todo el archivo)."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            posicion, datos = f.tell(), b""
+            while posicion > 0 and datos.count(b"\n") <= cantidad:
+                paso = min(bloque, posicion)
+                posicion -= paso
+                f.seek(posicion)
+                datos = f.read(paso) + datos
+    except OSError:
+        return []
+    lineas = datos.decode("utf-8", errors="replace").splitlines()
+    # Si no se llegó al principio, la primera línea puede estar cortada
+    return lineas[-cantidad:] if posicion == 0 else lineas[1:][-cantidad:]
+
+def leer_trazas(ultimas=2000):
+    """Últimas trazas del log de métricas (de todas las sesiones), completando con el log rotado si hace falta."""
+    if not ARCHIVO_METRICAS:
+        return []
+    lineas = deque(_ultimas_lineas(ARCHIVO_METRICAS, ultimas), maxlen=ultimas)
+    if len(lineas) < ultimas:
+        lineas.extendleft(reversed(_ultimas_lineas(f"{ARCHIVO_METRICAS}.1", ultimas - len(lineas))))
+    trazas = []
+    for linea in lineas:
+        try:
+            trazas.append(json.loads(linea))
+        except ValueError:
+            continue
+    return trazas
+
+def percentiles_etapas(trazas, percentiles=(50, 90, 99)):
+    """Latencia por etapa (ms) en los percentiles pedidos, a partir de las trazas del log."""
+    tiempos = defaultdict(list)
+    for traza in trazas:
+        for registro in traza.get("etapas", []):
+            tiempos[registro["etapa"]].append(registro["ms"])
+        if "total_ms" in traza:
+            tiempos["TOTAL"].append(traza["total_ms"])
+    filas = []
+    for nombre, valores in tiempos.items():
+        fila = {"etapa": nombre, "n": len(valores)}
+        fila.update({f"p{p}": round(float(v), 1) for p, v in zip(percentiles, np.percentile(valores, percentiles))})
+        filas.append(fila)
+    return pd.DataFrame(filas)
+
+def resumen_cache():
+    """Aciertos, fallos y tasa de acierto por caché desde que arrancó el proceso."""
+    with _lock_metricas:
+        filas = [{"cache": k, **v} for k, v in sorted(CONTADORES_CACHE.items())]
+    df = pd.DataFrame(filas, columns=["cache", "aciertos", "fallos"])
+    total = df["aciertos"] + df["fallos"]
+    df["tasa_acierto"] = (df["aciertos"] / total.where(total > 0)).round(3)
+    return df
+
+# --------------------------------------------------------------------------
+# 3. SNAPSHOTS EN DISCO (ARROW IPC)
+# --------------------------------------------------------------------------
+# Subir este número si cambia la normalización de los loaders (invalida snapshots viejos)
+VERSION_SNAPSHOT = 6
+
+def huella_archivo(path, huella_previa=None):
+    """Huella del archivo (ruta, mtime, tamaño y hash). Reutiliza el hash si mtime y tamaño no cambiaron."""
+    stat = os.stat(path)
+    huella = {"ruta": os.path.abspath(path), "mtime": stat.st_mtime_ns, "tamano": stat.st_size}
+
+    if huella_previa and all(huella_previa.get(k) == v for k, v in huella.items()):
+        huella["hash"] = huella_previa.get("hash")
+        return huella
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    huella["hash"] = h.hexdigest()
+    return huella
+
+def _leer_arrow(ruta):
+    """Lee un Arrow memory-mapeado sin copiar (una columna por bloque).
+
+    Números, fechas y códigos de categóricas quedan como vistas de solo lectura sobre el archivo, en la
+    caché de páginas del sistema; solo las columnas de texto libre se materializan. Escribir en ellas
+    levanta ValueError en vez de cambiarle los datos a todas las sesiones que las comparten.
+    """
+    return feather.read_table(ruta, memory_map=True).to_pandas(split_blocks=True)
+
+def _rutas_snapshot(nombre):
+    return os.path.join(CARPETA_CACHE, f"{nombre}.arrow"), os.path.join(CARPETA_CACHE, f"{nombre}.json")
+
+def _leer_meta_snapshot(nombre):
+    _, ruta_meta = _rutas_snapshot(nombre)
+    try:
+        with open(ruta_meta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def leer_snapshot(nombre, path_origen):
+    """Devuelve el DataFrame del snapshot si la huella del archivo origen coincide; si no, None."""
+    df = _leer_snapshot(nombre, path_origen)
+    registrar_cache("disco", nombre, df is not None)
+    return df
+
+def _leer_snapshot(nombre, path_origen):
+    ruta_arrow, ruta_meta = _rutas_snapshot(nombre)
+    meta = _leer_meta_snapshot(nombre)
+    if not meta or meta.get("version") != VERSION_SNAPSHOT or not os.path.exists(ruta_arrow):
+        return None
+
+    huella_guardada = meta.get("huella", {})
+    huella = huella_archivo(path_origen, huella_guardada)
+    if huella.get("hash") != huella_guardada.get("hash") or huella["ruta"] != huella_guardada.get("ruta"):
+        return None
+
+    try:
+        df = _leer_arrow(ruta_arrow)
+    except Exception:
+        return None
+
+    # Mismo contenido pero archivo "tocado" (mtime distinto): solo actualizamos la meta
+    if huella != huella_guardada:
+        meta["huella"] = huella
+        _escribir_atomico(ruta_meta, lambda tmp: _volcar_json(meta, tmp))
+    return df
+
+def snapshot_vigente(nombre, path_origen):
+    """True si el snapshot existe y corresponde al contenido actual del archivo origen (sin leerlo)."""
+    ruta_arrow, _ = _rutas_snapshot(nombre)
+    meta = _leer_meta_snapshot(nombre)
+    if not meta or meta.get("version") != VERSION_SNAPSHOT or not os.path.exists(ruta_arrow):
+        return False
+    huella_guardada = meta.get("huella", {})
+    huella = huella_archivo(path_origen, huella_guardada)
+    return huella.get("hash") == huella_guardada.get("hash") and huella["ruta"] == huella_guardada.get("ruta")
+
+def guardar_snapshot(nombre, path_origen, df):
+    """Persiste el DataFrame normalizado junto con la huella del origen y lo devuelve tal como quedó guardado.
+
+    Un fallo al escribir nunca interrumpe la carga: simplemente no habrá snapshot en el próximo arranque.
+    """
+    ruta_arrow, ruta_meta = _rutas_snapshot(nombre)
+    df_arrow = _columnas_mixtas_a_texto(df).reset_index(drop=True)
+    try:
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        meta = {"version": VERSION_SNAPSHOT, "huella": huella_archivo(path_origen)}
+        # Sin compresión para poder memory-mapear el archivo al leerlo
+        _escribir_atomico(ruta_arrow, lambda tmp: feather.write_feather(df_arrow, tmp, compression="uncompressed"))
+        _escribir_atomico(ruta_meta, lambda tmp: _volcar_json(meta, tmp))
+    except Exception:
+        pass
+    return df_arrow
+
+def guardar_snapshot_por_lotes(nombre, path_origen, leer_lotes):
+    """Como guardar_snapshot, pero volcando al Arrow lote a lote (ver volcar_lotes_arrow) y devolviendo la
+    versión memory-mapeada: la tabla completa nunca está entera en memoria mientras se escribe.
+
+    Si no se puede escribir en la caché se juntan los lotes en memoria, como antes, para no cortar la carga.
+    """
+    ruta_arrow, ruta_meta = _rutas_snapshot(nombre)
+    # La huella se toma antes de leer: si el archivo cambia durante la lectura, el snapshot ya nace vencido
+    meta = {"version": VERSION_SNAPSHOT, "huella": huella_archivo(path_origen)}
+    try:
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        _escribir_atomico(ruta_arrow, lambda tmp: volcar_lotes_arrow(leer_lotes, tmp))
+        _escribir_atomico(ruta_meta, lambda tmp: _volcar_json(meta, tmp))
+    except OSError:
+        lotes = list(leer_lotes())
+        return _columnas_mixtas_a_texto(pd.concat(lotes, ignore_index=True) if lotes else pd.DataFrame())
+    return _leer_arrow(ruta_arrow)
+
+def huella_fuente(nombre, path_origen):
+    """Hash de contenido de una fuente, reutilizando el de su snapshot si el archivo no se tocó (None si no existe)."""
+    if not path_origen or not os.path.exists(path_origen):
+        return None
+    meta = _leer_meta_snapshot(nombre) or {}
+    return huella_archivo(path_origen, meta.get("huella"))["hash"]
+
+def leer_artefacto(nombre, clave):
+    """Artefacto derivado (ej. columnas cruzadas) guardado con la clave de sus dependencias; None si no coincide."""
+    df = _leer_artefacto(nombre, clave)
+    registrar_cache("disco", nombre, df is not None)
+    return df
+
+def _leer_artefacto(nombre, clave):
+    ruta_arrow, _ = _rutas_snapshot(nombre)
+    meta = _leer_meta_snapshot(nombre)
+    if not meta or meta.get("version") != VERSION_SNAPSHOT or meta.get("clave") != clave:
+        return None
+    try:
+        df = _leer_arrow(ruta_arrow)
+    except Exception:
+        return None
+    df.attrs.update(meta.get("attrs", {}))
+    return df
+
+def artefacto_vigente(nombre, clave):
+    """True si hay un artefacto guardado con esa clave (sin leerlo)."""
+    meta = _leer_meta_snapshot(nombre)
+    return bool(meta) and meta.get("version") == VERSION_SNAPSHOT and meta.get("clave") == clave \
+        and os.path.exists(_rutas_snapshot(nombre)[0])
+
+def guardar_artefacto(nombre, clave, df):
+    """Persiste un artefacto derivado y lo devuelve tal como quedó guardado (mismo criterio que guardar_snapshot)."""
+    ruta_arrow, ruta_meta = _rutas_snapshot(nombre)
+    df_arrow = _columnas_mixtas_a_texto(df).reset_index(drop=True)
+    df_arrow.attrs = dict(df.attrs)
+    meta = {"version": VERSION_SNAPSHOT, "clave": clave, "attrs": df_arrow.attrs}
+    try:
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        _escribir_atomico(ruta_arrow, lambda tmp: feather.write_feather(df_arrow, tmp, compression="uncompressed"))
+        _escribir_atomico(ruta_meta, lambda tmp: _volcar_json(meta, tmp))
+        # Ya en disco: se devuelve la versión mapeada, igual a la de un arranque en caliente
+        df_arrow = _leer_arrow(ruta_arrow)
+        df_arrow.attrs.update(meta["attrs"])
+    except Exception:
+        pass
+    return df_arrow
+
+def _columnas_mixtas_a_texto(df):
+    """Arrow no admite columnas object con tipos mezclados (ej. 0 y 'LIMA'): se pasan a texto conservando NaN."""
+    # Copia liviana: solo se reemplazan las columnas mixtas, el resto se comparte con `df`
+    df = df.copy(deep=False)
+    for c in df.columns:
+        if df[c].dtype == object and pd.api.types.infer_dtype(df[c]) not in ("string", "empty"):
+            df[c] = df[c].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+def _volcar_json(data, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+def _escribir_atomico(path, escribir):
+    """Escribe en un temporal y lo renombra, para que un lector nunca vea un archivo a medias.
+
+    Devuelve lo que devuelva `escribir`.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        resultado = escribir(tmp)
+        os.replace(tmp, path)
+    finally:
+        # Si la escritura falló (disco lleno, error de datos) el temporal no queda ocupando lugar
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+    return resultado
+
+def _tipo_comun(a, b):
+    """Tipo Arrow que admite los valores de `a` y de `b`: números mezclados ➝ float64, fechas ➝ ns, otra mezcla ➝ texto."""
+    if a == b or pa.types.is_null(b):
+        return a
+    if pa.types.is_null(a):
+        return b
+    numerico = lambda t: pa.types.is_integer(t) or pa.types.is_floating(t)
+    if numerico(a) and numerico(b):
+        return pa.float64()
+    if pa.types.is_timestamp(a) and pa.types.is_timestamp(b) and a.tz == b.tz:
+        return pa.timestamp("ns", a.tz)  # Misma fecha con otra resolución (depende de cómo la leyó pandas)
+    return pa.string()
+
+def _tabla_lote(lote):
+    """Un lote como tabla Arrow (sin metadatos de pandas), con las columnas mixtas ya pasadas a texto."""
+    return pa.Table.from_pandas(_columnas_mixtas_a_texto(lote), preserve_index=False).replace_schema_metadata(None)
+
+def volcar_lotes_arrow(leer_lotes, path):
+    """Escribe los lotes de `leer_lotes()` (un generador nuevo en cada llamada) en un Arrow sin juntarlos en
+    memoria; devuelve cuántas filas escribió.
+
+    Las columnas mixtas se pasan a texto en cada lote y el esquema sale del primero. Si un lote posterior no
+    entra en él (ej. texto en una columna que empezó numérica, o decimales en una entera) se termina de
+    recorrer la fuente solo para conocer el tipo común de cada columna y se vuelve a escribir desde el
+    principio con esos tipos, así el resultado es el mismo que juntar todo antes de guardar.
+    """
+    tipos = {}
+    while True:
+        filas, conflicto = 0, False
+        with contextlib.ExitStack() as pila:
+            escritor = None
+            for lote in leer_lotes():
+                tabla = _tabla_lote(lote)
+                comunes = dict(tipos)
+                for campo in tabla.schema:
+                    comunes[campo.name] = _tipo_comun(tipos.get(campo.name, pa.null()), campo.type)
+                if comunes != tipos:
+                    # Antes de escribir el primer lote el esquema todavía se puede ampliar sin volver a empezar
+                    conflicto = conflicto or escritor is not None
+                    tipos = comunes
+                if conflicto:
+                    continue
+                esquema = pa.schema(list(tipos.items()))
+                if escritor is None:
+                    escritor = pila.enter_context(pa.ipc.new_file(path, esquema))
+                escritor.write_table(tabla.cast(esquema))
+                filas += tabla.num_rows
+            if escritor is None:
+                pila.enter_context(pa.ipc.new_file(path, pa.schema(list(tipos.items()))))
+        if not conflicto:
+            return filas
+
+# --------------------------------------------------------------------------
+# 4. LECTURA DE FUENTES
+# --------------------------------------------------------------------------
+FILAS_BUSQUEDA_HEADER = 15
+TAMANO_LOTE = 50_000
+
+class ColumnaFaltanteError(ValueError):
+    """El archivo de ventas no tiene una columna imprescindible (ej. CAI)."""
+
+def _es_fila_header(valores):
+    textos = [str(v).upper() for v in valores]
+    return "CAI" in textos or "FECHA" in textos or "CLIENTE" in textos or "CANTIDAD" in textos
+
+# Textos que pandas.read_excel interpreta como vacío (openpyxl los entrega tal cual, ej. celdas #N/A)
+VALORES_NULOS = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                 "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+
+def _aplicar_nulos_excel(df):
+    for c in df.columns:
+        # Texto como object o, en pandas 3, como dtype str
+        if pd.api.types.is_object_dtype(df[c]) or pd.api.types.is_string_dtype(df[c]):
+            # Las celdas vacías llegan como None (read_excel las deja en NaN)
+            df[c] = df[c].mask(df[c].isna() | df[c].isin(VALORES_NULOS))
+    return df.infer_objects()
+
+def _nombres_columnas(valores):
+    """Nombres de columnas al estilo pandas: vacíos como 'Unnamed: i' y duplicados con sufijo '.n'."""
+    nombres, vistos = [], {}
+    for i, v in enumerate(valores):
+        nombre = f"Unnamed: {i}" if v is None or (isinstance(v, float) and np.isnan(v)) else str(v)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+def _normalizar_columnas_so(columnas, nombre_archivo):
+    """Mayúsculas, sinónimos y detección de CAI sobre el encabezado (se resuelve una sola vez)."""
+    columnas = [str(c).upper().strip() for c in columnas]
+
+    correcciones = {
+        'ANO': 'AÑO', 'YEAR': 'AÑO', 'MONTH': 'MES', 'DATE': 'FECHA',
+        'NOMBRE CLIENTE': 'CLIENTE', 'CUSTOMER': 'CLIENTE',
+        'CODIGO': 'CAI', 'MATERIAL': 'CAI', 'ARTICULO': 'CAI' 
+    }
+    for k, v in correcciones.items():
+        if k in columnas and v not in columnas:
+            columnas = [v if c == k else c for c in columnas]
+
+    if 'CAI' not in columnas:
+        candidato = next((c for c in columnas if c.startswith("COD") or c.startswith("MAT")), None)
+        if not candidato:
+            raise ColumnaFaltanteError(f"No se detectó columna CAI en archivo de ventas: {nombre_archivo}")
+        columnas = ['CAI' if c == candidato else c for c in columnas]
+
+    return columnas
+
+def _normalizar_lote_so(df):
+    """Limpieza de un lote ya con columnas normalizadas: CLIENTE, CANTIDAD y FECHA_DT."""
+    if 'CLIENTE' in df.columns:
+        cliente = df['CLIENTE'].astype(str).str.strip().str.upper()
+        df['CLIENTE'] = cliente.where(~cliente.str.endswith('.'), cliente.str[:-1])
+
+    if 'CANTIDAD' in df.columns:
+        df['CANTIDAD'] = pd.to_numeric(df['CANTIDAD'], errors='coerce')
+
+    if 'FECHA' in df.columns:
+        df['FECHA_DT'] = pd.to_datetime(df['FECHA'], errors='coerce')
+    elif 'AÑO' in df.columns and 'MES' in df.columns:
+        df['AÑO'] = pd.to_numeric(df['AÑO'], errors='coerce').fillna(0).astype(int)
+        df['MES'] = pd.to_numeric(df['MES'], errors='coerce').fillna(1).astype(int)
+        df['FECHA_DT'] = pd.to_datetime(pd.DataFrame({'year': df['AÑO'], 'month': df['MES'], 'day': 1}), errors='coerce')
+    return df
+
+def leer_sell_out_por_lotes(path, tamano_lote=TAMANO_LOTE):
+    """Cazador de Encabezados en streaming: abre el archivo una sola vez y entrega lotes ya normalizados.
+
+    El encabezado se busca en las primeras FILAS_BUSQUEDA_HEADER filas; si no aparece se usa la primera.
+    """
+    nombre_archivo = os.path.basename(path)
+
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            # Igual que pandas, las líneas vacías no cuentan para el número de fila del encabezado
+            iniciales = []
+            for linea in f:
+                fila = next(csv.reader([linea]), [])
+                if fila:
+                    iniciales.append(fila)
+                if len(iniciales) == FILAS_BUSQUEDA_HEADER:
+                    break
+            fila_header = next((i for i, fila in enumerate(iniciales) if _es_fila_header(fila)), 0)
+            f.seek(0)
+            lector = pd.read_csv(f, header=fila_header, chunksize=tamano_lote)
+            columnas = None
+            for lote in lector:
+                if columnas is None:
+                    columnas = _normalizar_columnas_so(lote.columns, nombre_archivo)
+                lote.columns = columnas
+                yield _normalizar_lote_so(lote)
+        return
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        hoja = "Sell Out" if "Sell Out" in wb.sheetnames else wb.sheetnames[0]
+        filas = (fila for fila in wb[hoja].iter_rows(values_only=True) if any(v is not None for v in fila))
+
+        # Solo las primeras filas quedan en memoria mientras buscamos el encabezado
+        iniciales = list(itertools.islice(filas, FILAS_BUSQUEDA_HEADER))
+        if not iniciales:
+            return
+        fila_header = next((i for i, fila in enumerate(iniciales) if _es_fila_header(fila)), 0)
+        encabezado = _nombres_columnas(iniciales[fila_header])
+        columnas = _normalizar_columnas_so(encabezado, nombre_archivo)
+        ancho = len(columnas)
+
+        datos = itertools.chain(iniciales[fila_header + 1:], filas)
+        while True:
+            bloque = [fila[:ancho] for fila in itertools.islice(datos, tamano_lote)]
+            if not bloque:
+                break
+            lote = pd.DataFrame.from_records(bloque, columns=columnas)
+            yield _normalizar_lote_so(_aplicar_nulos_excel(lote))
+    finally:
+        wb.close()
+
+def ubicar_sell_out():
+    """Ruta del archivo de ventas en la raíz, ignorando los maestros de Zonas/CAI (None si no hay)."""
+    # Ahora buscamos directamente en la carpeta actual
+    ruta_folder = CARPETA_DATOS
+    
+    if os.path.exists(ruta_folder):
+        for f in os.listdir(ruta_folder):
+            # Filtramos para encontrar SOLO el archivo de ventas
+            # Debe tener "Sell Out" o "SO", ser Excel/CSV, NO ser temporal (~$)
+            # Y MUY IMPORTANTE: NO debe ser el archivo de Zonas ni el Histórico
+            if ("Sell Out" in f or "SO" in f) and (f.endswith(".xlsx") or f.endswith(".csv")):
+                if not f.startswith("~$") and "Zonas" not in f and "historico" not in f and "CAI" not in f:
+                    return os.path.join(ruta_folder, f)
+    return None
+
+def ubicar_maestro_zonas():
+    """Ruta de Sell Out Zonas en la raíz (None si no hay)."""
+    possible_names = ["Sell Out Zonas.xlsx", "Sell Out Zonas.xls"]
+    for name in possible_names:
+        temp_path = os.path.join(CARPETA_DATOS, name)
+        if os.path.exists(temp_path):
+            return temp_path
+    return None
+
+NOMBRE_MAESTRO_CAI = "CAI historico 2.xlsx"
+
+def ubicar_maestro_cai():
+    """Ruta del catálogo CAI; la búsqueda es insensible a mayúsculas (para Linux)."""
+    archivo_path = os.path.join(CARPETA_DATOS, NOMBRE_MAESTRO_CAI)
+    if not os.path.exists(archivo_path):
+        for f in os.listdir(CARPETA_DATOS):
+            if f.lower() == NOMBRE_MAESTRO_CAI.lower():
+                return os.path.join(CARPETA_DATOS, f)
+    return archivo_path
+
+def listar_particiones():
+    """Archivos de Sell Out en CARPETA_PARTICIONES, ordenados por nombre (vacío si no hay carpeta)."""
+    if not os.path.isdir(CARPETA_PARTICIONES):
+        return []
+    return sorted(
+        os.path.join(CARPETA_PARTICIONES, f) for f in os.listdir(CARPETA_PARTICIONES)
+        if f.lower().endswith((".xlsx", ".csv")) and not f.startswith("~$")
+    )
+
+# --- Particiones: cada archivo se normaliza una sola vez y queda como un Arrow propio en la caché.
+# El manifiesto guarda nombre ➝ huella, así que al sumar un mes solo se lee ese archivo.
+def _ruta_manifiesto():
+    return os.path.join(CARPETA_CACHE, "particiones", "manifiesto.json")
+
+def leer_manifiesto():
+    """Particiones ya ingeridas: {nombre: {"huella", "archivo", "filas"}} (vacío si no hay o es de otra versión)."""
+    try:
+        with open(_ruta_manifiesto(), encoding="utf-8") as f:
+            manifiesto = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifiesto.get("version") != VERSION_SNAPSHOT:
+        return {}
+    return manifiesto.get("particiones", {})
+
+def _guardar_manifiesto(particiones):
+    ruta = _ruta_manifiesto()
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    _escribir_atomico(ruta, lambda tmp: _volcar_json({"version": VERSION_SNAPSHOT, "particiones": particiones}, tmp))
+
+def huella_particiones(paths=None):
+    """Hash combinado de todas las particiones (nombre + contenido); reutiliza los hashes del manifiesto."""
+    paths = listar_particiones() if paths is None else paths
+    if not paths:
+        return None
+    manifiesto = leer_manifiesto()
+    h = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        nombre = os.path.basename(path)
+        huella = huella_archivo(path, manifiesto.get(nombre, {}).get("huella"))
+        h.update(f"{nombre}\0{huella['hash']}\0".encode("utf-8"))
+    return h.hexdigest()
+
+def _carpeta_cache_particiones():
+    return os.path.join(CARPETA_CACHE, "particiones")
+
+def _particion_vigente(path, entrada):
+    """True si la partición no cambió desde que se ingirió y su Arrow sigue en la caché."""
+    huella = huella_archivo(path, entrada.get("huella"))
+    return (entrada.get("huella", {}).get("hash") == huella["hash"]
+            and os.path.isfile(os.path.join(_carpeta_cache_particiones(), entrada.get("archivo", ""))))
+
+def _normalizar_particion(path, huella=None):
+    """Lee una partición y la deja como Arrow en la caché. Devuelve (df, entrada del manifiesto)."""
+    nombre = os.path.basename(path)
+    huella = huella or huella_archivo(path)
+    carpeta = _carpeta_cache_particiones()
+    os.makedirs(carpeta, exist_ok=True)
+    archivo = hashlib.blake2b(nombre.encode("utf-8"), digest_size=8).hexdigest() + ".arrow"
+    ruta = os.path.join(carpeta, archivo)
+    with medir_etapa(f"particion:{nombre}") as registro:
+        # Cada lote normalizado va directo al Arrow; después se lee memory-mapeado
+        registro["filas"] = _escribir_atomico(ruta, lambda tmp: volcar_lotes_arrow(lambda: leer_sell_out_por_lotes(path), tmp))
+    df = _leer_arrow(ruta)
+    return df, {"huella": huella, "archivo": archivo, "filas": len(df)}
+
+def ingerir_particiones(paths):
+    """Normaliza solo las particiones nuevas o cambiadas y devuelve la tabla de hechos completa.
+
+    Las que no cambiaron se leen (memory-map) desde su Arrow; las que ya no están en la carpeta se
+    descartan del manifiesto. Devuelve (df, n_leidas).
+    """
+    carpeta = _carpeta_cache_particiones()
+    os.makedirs(carpeta, exist_ok=True)
+    previas = leer_manifiesto()
+    vigentes, partes, n_leidas = {}, [], 0
+
+    for path in paths:
+        nombre = os.path.basename(path)
+        entrada = previas.get(nombre, {})
+        huella = huella_archivo(path, entrada.get("huella"))
+        df = None
+        if entrada.get("huella", {}).get("hash") == huella["hash"]:
+            try:
+                df = _leer_arrow(os.path.join(carpeta, entrada.get("archivo", "")))
+            except Exception:
+                df = None
+        registrar_cache("disco", "particion", df is not None)
+
+        if df is None:
+            df, entrada = _normalizar_particion(path, huella)
+            n_leidas += 1
+
+        vigentes[nombre] = {"huella": huella, "archivo": entrada["archivo"], "filas": len(df)}
+        partes.append(df)
+
+    # Particiones que salieron de la carpeta: fuera del manifiesto y de la caché
+    for nombre, entrada in previas.items():
+        if nombre not in vigentes and entrada.get("archivo"):
+            try:
+                os.remove(os.path.join(carpeta, entrada["archivo"]))
+            except OSError:
+                pass
+    _guardar_manifiesto(vigentes)
+
+    df = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
+    # Un mismo campo puede venir como número en un archivo y como texto en otro
+    return _columnas_mixtas_a_texto(df), n_leidas
+
+@etapa("carga_sell_out")
+def cargar_sell_out_neuma(avisos=None):
+    """Carga el Sell Out: particiones si hay carpeta, si no el archivo de la raíz (snapshot si está vigente)."""
+    particiones = listar_particiones()
+    if particiones:
+        try:
+            df, _ = ingerir_particiones(particiones)
+            return df
+        except ColumnaFaltanteError:
+            raise
+        except Exception as e:
+            _avisar(avisos, "error", f"Error procesando las particiones de ventas: {e}")
+            return None
+
+    archivo_encontrado = ubicar_sell_out()
+    
+    if archivo_encontrado:
+        df_snap = leer_snapshot("sell_out", archivo_encontrado)
+        if df_snap is not None:
+            return df_snap
+
+        try:
+            return guardar_snapshot_por_lotes("sell_out", archivo_encontrado,
+                                              lambda: leer_sell_out_por_lotes(archivo_encontrado))
+
+        except ColumnaFaltanteError:
+            raise
+        except Exception as e:
+            _avisar(avisos, "error", f"Error procesando archivo de ventas: {e}")
+            return None
+            
+    _avisar(avisos, "warning", "⚠️ No encontré el archivo de Ventas (Sell Out) en la carpeta raíz.")
+    return None
+
+@etapa("carga_zonas")
+def cargar_maestro_zonas_seguro(avisos=None):
+    """Carga Sell Out Zonas.xlsx desde la raíz (snapshot si está vigente)."""
+    archivo_path = ubicar_maestro_zonas()
+    
+    if archivo_path:
+        df_snap = leer_snapshot("zonas", archivo_path)
+        if df_snap is not None:
+            return df_snap
+
+        try:
+            xl = pd.ExcelFile(archivo_path)
+            sheet = 'Sell Out' if 'Sell Out' in xl.sheet_names else xl.sheet_names[0]
+            df_z = pd.read_excel(xl, sheet_name=sheet)
+            df_z.columns = [str(c).strip().upper() for c in df_z.columns]
+            
+            if 'AM' in df_z.columns: df_z.rename(columns={'AM': 'ACCOUNT MANAGER'}, inplace=True)
+            if 'ACOOUNT MANAGER' in df_z.columns: df_z.rename(columns={'ACOOUNT MANAGER': 'ACCOUNT MANAGER'}, inplace=True)
+            
+            cols_permitidas = ['COD.CLIENTE', 'ACCOUNT MANAGER', 'DEPARTAMENTO', 'PROVINCIA', 'DISTRITO']
+            cols_finales = [c for c in cols_permitidas if c in df_z.columns]
+            df_z = df_z[cols_finales]
+            
+            if 'COD.CLIENTE' in df_z.columns:
+                df_z = df_z.drop_duplicates('COD.CLIENTE')
+                df_z['COD.CLIENTE'] = df_z['COD.CLIENTE'].astype(str).str.strip()
+                return guardar_snapshot("zonas", archivo_path, df_z)
+        except Exception as e:
+            _avisar(avisos, "error", f"Error procesando Zonas: {e}")
+    return None
+
+@etapa("carga_maestro_cai")
+def cargar_maestro_filtros(avisos=None):
+    """Carga el catálogo buscando DENOMINATION (Descripción) con inteligencia (snapshot si está vigente)."""
+    archivo_path = ubicar_maestro_cai()
+
+    if os.path.exists(archivo_path):
+        df_snap = leer_snapshot("maestro_cai", archivo_path)
+        if df_snap is not None:
+            return df_snap
+
+        try:
+            df = pd.read_excel(archivo_path)
+            df.columns = [str(c).upper().strip() for c in df.columns]
+            
+            # --- DICCIONARIO DE SINÓNIMOS PARA UNIFICAR ---
+            renames = {
+                # Segmentos
+                'SEGMENTO': 'SEGMENTO LB', 
+                'MACRO MACHINE': 'MACRO_ MACHINE',
+                # Clasificación
+                'CLASIFICACION DR': 'CLASIFICACIÓN DR',
+                # Códigos
+                'CODIGO': 'CAI', 'COD': 'CAI', 'MATERIAL': 'CAI',
+                # === AQUÍ ESTÁ EL ARREGLO DE LA DESCRIPCIÓN ===
+                'DESCRIPCION': 'DENOMINATION',
+                'DESCRIPCIÓN': 'DENOMINATION',
+                'NOMBRE': 'DENOMINATION',
+                'NOMBRE ARTICULO': 'DENOMINATION',
+                'MATERIAL DESCRIPTION': 'DENOMINATION',
+                'TXT.BREVE MATERIAL': 'DENOMINATION'
+            }
+            
+            # Aplicar renombres
+            # Usamos un bucle para evitar errores si la columna no existe
+            cols_renombrar = {}
+            for k, v in renames.items():
+                if k in df.columns and v not in df.columns:
+                    cols_renombrar[k] = v
+            
+            if cols_renombrar:
+                df.rename(columns=cols_renombrar, inplace=True)
+            
+            # Asegurar CAI
+            if 'CAI' not in df.columns:
+                 col_cai = next((c for c in df.columns if "CAI" in c or "COD" in c), "CAI")
+                 df.rename(columns={col_cai: 'CAI'}, inplace=True)
+            
+            return guardar_snapshot("maestro_cai", archivo_path, df)
+        except Exception as e:
+            _avisar(avisos, "error", f"Error leyendo el maestro: {e}")
+    else:
+        _avisar(avisos, "warning", f"⚠️ No encuentro el archivo '{NOMBRE_MAESTRO_CAI}' en la nube. Verifica el nombre exacto en GitHub.")
+        
+    return None
+
+# --- Arranque en frío en paralelo: cada fuente vencida (o partición nueva) se normaliza en su propio
+# proceso, que deja el snapshot Arrow en disco. Al proceso principal no le viajan DataFrames por pickle:
+# después los loaders de siempre encuentran el snapshot vigente y solo lo memory-mapean.
+CARGADORES = {
+    "sell_out": cargar_sell_out_neuma,
+    "zonas": cargar_maestro_zonas_seguro,
+    "maestro_cai": cargar_maestro_filtros,
+}
+# Procesos para la carga en frío (0 = uno por núcleo; 1 = secuencial, como antes)
+PROCESOS_CARGA = int(os.environ.get("SELLOUT_PROCESOS", "0"))
+
+def _tarea_en_proceso(carpetas, tipo, argumento):
+    """Corre en el proceso hijo: normaliza una fuente o partición y deja su Arrow en la caché."""
+    global CARPETA_DATOS, CARPETA_CACHE, CARPETA_PARTICIONES
+    CARPETA_DATOS, CARPETA_CACHE, CARPETA_PARTICIONES = carpetas
+    if tipo == "particion":
+        return _normalizar_particion(argumento)[1]
+    CARGADORES[argumento](avisos=[])
+    return None
+
+def tareas_de_carga(fuentes=("sell_out", "zonas", "maestro_cai")):
+    """Fuentes (o particiones) cuyo snapshot no está vigente: [(tipo, argumento)]."""
+    tareas = []
+    if "sell_out" in fuentes:
+        particiones = listar_particiones()
+        if particiones:
+            manifiesto = leer_manifiesto()
+            tareas += [("particion", p) for p in particiones
+                       if not _particion_vigente(p, manifiesto.get(os.path.basename(p), {}))]
+        elif ubicar_sell_out() and not snapshot_vigente("sell_out", ubicar_sell_out()):
+            tareas.append(("fuente", "sell_out"))
+    for nombre, ubicar in (("zonas", ubicar_maestro_zonas), ("maestro_cai", ubicar_maestro_cai)):
+        path = ubicar() if nombre in fuentes else None
+        if path and os.path.exists(path) and not snapshot_vigente(nombre, path):
+            tareas.append(("fuente", nombre))
+    return tareas
+
+def precargar_fuentes(fuentes=("sell_out", "zonas", "maestro_cai"), procesos=None):
+    """Normaliza en paralelo las fuentes vencidas; devuelve cuántas tareas corrieron en el pool.
+
+    Es solo un adelanto: los errores no se informan aquí. Si una tarea falla (o el pool no se puede
+    crear), el loader correspondiente la repite en este proceso y avisa o levanta como siempre.
+    """
+    tareas = tareas_de_carga(fuentes)
+    procesos = min(len(tareas), procesos or PROCESOS_CARGA or os.cpu_count() or 1)
+    if procesos <= 1:
+        return 0
+
+    with medir_etapa("carga_paralela") as registro:
+        registro.update(tareas=len(tareas), procesos=procesos)
+        carpetas = (CARPETA_DATOS, CARPETA_CACHE, CARPETA_PARTICIONES)
+        particiones = {}
+        try:
+            # spawn: el hijo no hereda hilos ni locks del servidor (fork con hilos puede colgarse)
+            contexto = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+                futuros = {pool.submit(_tarea_en_proceso, carpetas, tipo, arg): (tipo, arg) for tipo, arg in tareas}
+                for futuro in as_completed(futuros):
+                    tipo, arg = futuros[futuro]
+                    try:
+                        entrada = futuro.result()
+                    except Exception:
+                        continue
+                    if tipo == "particion":
+                        particiones[os.path.basename(arg)] = entrada
+        except Exception:
+            pass
+
+        # El manifiesto lo escribe solo este proceso, para que los hijos no se pisen
+        if particiones:
+            _guardar_manifiesto({**leer_manifiesto(), **particiones})
+    return len(tareas)
+
+# --------------------------------------------------------------------------
+# 5. CRUCE CON ZONAS Y PRODUCTOS
+# --------------------------------------------------------------------------
+COLS_ZONA = ['ACCOUNT MANAGER', 'DEPARTAMENTO', 'PROVINCIA', 'DISTRITO']
+COLS_PRODUCTO = ['Segmento LB', 'MARCA', 'MACRO_ MACHINE', 'DENOMINATION', 'CLASIFICACIÓN DR']
+# Dimensiones que se guardan como categóricas (diccionario + códigos enteros)
+DIMENSIONES = ['CLIENTE', 'COD.CLIENTE', 'CAI_Clean'] + COLS_PRODUCTO + COLS_ZONA
+
+def firma_fuentes():
+    """Firma barata de las fuentes (ruta, mtime y tamaño de cada archivo), sin leer su contenido.
+
+    La usa el vigilante para esperar a que un archivo termine de copiarse antes de hashearlo.
+    """
+    paths = listar_particiones() or [ubicar_sell_out()]
+    paths += [ubicar_maestro_zonas(), ubicar_maestro_cai()]
+    firma = []
+    for path in paths:
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            stat = None
+        firma.append((path, stat.st_mtime_ns, stat.st_size) if stat else (path, None, None))
+    return tuple(firma)
+
+@etapa("huellas_fuentes")
+def huellas_fuentes():
+    """Huella (hash de contenido) de las tres fuentes: son las dependencias de la tabla unificada."""
+    return (
+        huella_particiones() or huella_fuente("sell_out", ubicar_sell_out()),
+        huella_fuente("zonas", ubicar_maestro_zonas()),
+        huella_fuente("maestro_cai", ubicar_maestro_cai()),
+    )
+
+def construir_base_ventas(avisos=None):
+    """Sell Out con las claves de cruce limpias (COD.CLIENTE y CAI_Clean)."""
+    df_base = cargar_sell_out_neuma(avisos)
+    if df_base is None:
+        return None
+
+    df_base = df_base.copy()
+    if 'COD.CLIENTE' in df_base.columns:
+        df_base['COD.CLIENTE'] = df_base['COD.CLIENTE'].astype(str).str.strip()
+
+    # Salvar CAI si se perdió
+    if 'CAI' not in df_base.columns:
+        if 'CAI_x' in df_base.columns: df_base.rename(columns={'CAI_x': 'CAI'}, inplace=True)
+        elif 'CODIGO' in df_base.columns: df_base.rename(columns={'CODIGO': 'CAI'}, inplace=True)
+
+    if 'CAI' in df_base.columns:
+        df_base['CAI_Clean'] = df_base['CAI'].astype(str).str.strip()
+    else:
+        df_base['CAI_Clean'] = "SIN CAI"
+    return df_base
+
+@etapa("cruce_zonas")
+def construir_columnas_zona(df_base, huella_so, huella_zonas, avisos=None):
+    """Columnas de zona alineadas fila a fila con la base de ventas. Solo depende de Sell Out y Zonas."""
+    clave = f"{huella_so}|{huella_zonas}"
+    df_cols = leer_artefacto("cruce_zonas", clave)
+    if df_cols is not None:
+        return df_cols
+
+    df_zonas = cargar_maestro_zonas_seguro(avisos)
+    if df_zonas is None or 'COD.CLIENTE' not in df_base.columns:
+        return pd.DataFrame(index=pd.RangeIndex(len(df_base)))
+
+    # Las columnas que ya trae el Sell Out tienen prioridad sobre las del maestro
+    cols_nuevas = [c for c in df_zonas.columns if c != 'COD.CLIENTE' and c not in df_base.columns]
+    df_cols = pd.merge(df_base[['COD.CLIENTE']], df_zonas[['COD.CLIENTE'] + cols_nuevas], on='COD.CLIENTE', how='left')
+    df_cols = df_cols[cols_nuevas]
+
+    for c in COLS_ZONA:
+        if c in df_cols.columns: df_cols[c] = df_cols[c].fillna("SIN ASIGNAR")
+
+    return guardar_artefacto("cruce_zonas", clave, df_cols)
+
+@etapa("cruce_productos")
+def construir_columnas_producto(df_base, huella_so, huella_cai, avisos=None):
+    """Columnas del maestro de productos alineadas fila a fila con la base de ventas. Solo depende de Sell Out y CAI."""
+    clave = f"{huella_so}|{huella_cai}"
+    df_cols = leer_artefacto("cruce_productos", clave)
+    if df_cols is not None:
+        return df_cols
+
+    df_maestro = cargar_maestro_filtros(avisos)
+    if df_maestro is None or 'CAI' not in df_base.columns:
+        return pd.DataFrame(index=pd.RangeIndex(len(df_base)))
+
+    posibles_cols = ['CAI', 'SEGMENTO LB', 'MARCA', 'MACRO_ MACHINE', 'DENOMINATION', 'CLASIFICACIÓN DR', 'CLASIFICACION DR']
+    cols_m = [c for c in posibles_cols if c in df_maestro.columns]
+    
+    maestro_min = df_maestro[cols_m].copy()
+    if 'CLASIFICACION DR' in maestro_min.columns and 'CLASIFICACIÓN DR' not in maestro_min.columns:
+        maestro_min.rename(columns={'CLASIFICACION DR': 'CLASIFICACIÓN DR'}, inplace=True)
+        
+    maestro_min.rename(columns={'SEGMENTO LB': 'Segmento LB', 'MACRO MACHINE': 'MACRO_ MACHINE'}, inplace=True)
+    
+    col_cai_m = next((c for c in maestro_min.columns if "CAI" in c), "CAI")
+    maestro_min['CAI_Clean'] = maestro_min[col_cai_m].astype(str).str.strip()
+    maestro_min = maestro_min.drop(columns=[col_cai_m], errors='ignore').drop_duplicates('CAI_Clean')
+
+    # Merge (igual que en zonas, si el Sell Out ya trae la columna manda la del Sell Out)
+    cols_nuevas = [c for c in maestro_min.columns if c != 'CAI_Clean' and c not in df_base.columns]
+    df_cols = pd.merge(df_base[['CAI_Clean']], maestro_min[['CAI_Clean'] + cols_nuevas], on='CAI_Clean', how='left')
+    df_cols = df_cols[cols_nuevas]
+    
+    for c in COLS_PRODUCTO:
+        if c in df_cols.columns: df_cols[c] = df_cols[c].fillna("OTROS")
+
+    return guardar_artefacto("cruce_productos", clave, df_cols)
+
+@etapa("compactar")
+def compactar_tabla(df):
+    """Dimensiones a categóricas y CANTIDAD/AÑO/MES al entero más chico que las contenga.
+
+    Si una columna tiene decimales o nulos queda en float64: pasarla a float32 haría que las sumas de las
+    ventanas y los totales se alejen de las originales. FECHA_DT se mantiene en datetime64 (ya es un entero
+    de 8 bytes, no un objeto Python).
+    """
+    df = df.copy()
+    for c in DIMENSIONES:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype(str).astype('category')
+
+    for c in ['CANTIDAD', 'AÑO', 'MES']:
+        if c in df.columns and pd.api.types.is_numeric_dtype(df[c]):
+            valores = df[c]
+            if valores.notna().all() and (valores % 1 == 0).all():
+                df[c] = pd.to_numeric(valores.astype('int64'), downcast='integer')
+            else:
+                df[c] = valores.astype('float64')
+    return df
+
+def medir_compactacion(df_antes, df_despues):
+    """Memoria y tiempo del groupby del monitor (CLIENTE x CAI) antes y después de compactar."""
+    def tiempo_groupby(df):
+        cols = [c for c in ['CLIENTE', 'CAI_Clean'] if c in df.columns]
+        if not cols or 'CANTIDAD' not in df.columns:
+            return 0.0
+        t0 = time.perf_counter()
+        df.groupby(cols, observed=True)['CANTIDAD'].sum()
+        return time.perf_counter() - t0
+
+    return {
+        "mb_antes": df_antes.memory_usage(deep=True).sum() / 1e6,
+        "mb_despues": df_despues.memory_usage(deep=True).sum() / 1e6,
+        "groupby_ms_antes": tiempo_groupby(df_antes) * 1000,
+        "groupby_ms_despues": tiempo_groupby(df_despues) * 1000,
+    }
+
+@etapa("tabla_unificada")
+def construir_tabla_unificada(huella_so, huella_zonas, huella_cai, avisos=None):
+    """Tabla de hechos unificada (ya compactada). None si no hay Sell Out.
+
+    Primero busca la tabla precalculada; si no está vigente, arma las piezas. Las columnas de cada maestro
+    se guardan aparte con la clave de sus dos dependencias, así que si solo cambia un maestro se recalculan
+    únicamente sus columnas. Sale del Arrow mapeado en modo solo lectura: se comparte entre sesiones sin copiar.
+    """
+    clave = f"{huella_so}|{huella_zonas}|{huella_cai}"
+    df_compacto = leer_artefacto("tabla_unificada", clave)
+    if df_compacto is not None:
+        return df_compacto
+
+    # Solo se adelantan los maestros cuyas columnas cruzadas haya que recalcular
+    precargar_fuentes(["sell_out"]
+                      + (["zonas"] if not artefacto_vigente("cruce_zonas", f"{huella_so}|{huella_zonas}") else [])
+                      + (["maestro_cai"] if not artefacto_vigente("cruce_productos", f"{huella_so}|{huella_cai}") else []))
+    df_base = construir_base_ventas(avisos)
+    if df_base is None:
+        return None
+
+    df_zona = construir_columnas_zona(df_base, huella_so, huella_zonas, avisos)
+    df_prod = construir_columnas_producto(df_base, huella_so, huella_cai, avisos)
+
+    # Mismo orden de columnas que el cruce original: base, zonas, CAI_Clean, productos
+    cols_base = [c for c in df_base.columns if c != 'CAI_Clean']
+    partes = [df_base[cols_base].reset_index(drop=True), df_zona, df_base[['CAI_Clean']].reset_index(drop=True), df_prod]
+    df_unificado = pd.concat(partes, axis=1)
+
+    df_compacto = compactar_tabla(df_unificado)
+    df_compacto.attrs["compactacion"] = medir_compactacion(df_unificado, df_compacto)
+    return guardar_artefacto("tabla_unificada", clave, df_compacto)
+
+@etapa("cubo")
+def construir_cubo(huella_so, huella_zonas, huella_cai, df_unificado=None, avisos=None):
+    """Cubo diario cliente × producto × fecha de compra: cantidad total y número de registros.
+
+    Conserva todas las dimensiones (para filtrar igual que la tabla) y la fecha exacta, ordenado por fecha:
+    de acá se toman solo las filas de los meses que un periodo móvil corta a la mitad (ver filas_ventanas).
+    El dashboard filtra y agrega sobre el cubo mensual.
+    """
+    clave = f"{huella_so}|{huella_zonas}|{huella_cai}"
+    df_cubo = leer_artefacto("cubo", clave)
+    if df_cubo is not None:
+        return df_cubo
+
+    df = df_unificado if df_unificado is not None else construir_tabla_unificada(huella_so, huella_zonas, huella_cai, avisos)
+    if df is None:
+        return None
+    llaves = [c for c in DIMENSIONES if c in df.columns] + (['FECHA_DT'] if 'FECHA_DT' in df.columns else [])
+    cantidad = df['CANTIDAD'].astype(np.int64 if pd.api.types.is_integer_dtype(df['CANTIDAD']) else np.float64)
+
+    df_cubo = (
+        df[llaves].assign(CANTIDAD=cantidad, N_REG=1)
+        .groupby(llaves, observed=True, dropna=False, sort=False)
+        .agg(CANTIDAD=('CANTIDAD', 'sum'), N_REG=('N_REG', 'sum'))
+        .reset_index()
+    )
+    if 'FECHA_DT' in df_cubo.columns:
+        df_cubo = df_cubo.sort_values('FECHA_DT', kind='stable', ignore_index=True)
+    return guardar_artefacto("cubo", clave, df_cubo)
+
+@etapa("cubo_mensual")
+def construir_cubo_mensual(huella_so, huella_zonas, huella_cai, df_cubo=None, avisos=None):
+    """Cubo cliente × producto × mes (MES = primer día del mes) con las mismas dimensiones.
+
+    FECHA_DT es la última compra del grupo en ese mes: sirve como última compra de la grilla y, como un mes
+    que ningún periodo corta cae entero dentro o fuera de cada tramo, también para ubicarlo en las ventanas.
+    Es la tabla que filtra el sidebar y que alimenta la grilla y los gráficos.
+    """
+    clave = f"{huella_so}|{huella_zonas}|{huella_cai}"
+    df_mes = leer_artefacto("cubo_mensual", clave)
+    if df_mes is not None:
+        return df_mes
+
+    df = df_cubo if df_cubo is not None else construir_cubo(huella_so, huella_zonas, huella_cai, avisos=avisos)
+    if df is None or 'FECHA_DT' not in df.columns:
+        return None
+    llaves = [c for c in DIMENSIONES if c in df.columns]
+    df_mes = (
+        df[llaves + ['FECHA_DT', 'CANTIDAD', 'N_REG']].assign(MES=df['FECHA_DT'].dt.to_period('M').dt.to_timestamp())
+        .groupby(llaves + ['MES'], observed=True, dropna=False, sort=False)
+        .agg(FECHA_DT=('FECHA_DT', 'max'), CANTIDAD=('CANTIDAD', 'sum'), N_REG=('N_REG', 'sum'))
+        .reset_index()
+    )
+    return guardar_artefacto("cubo_mensual", clave, df_mes)
+
+def precalcular(forzar=False, avisos=None):
+    """Arma y persiste la tabla unificada y los cubos para las fuentes actuales. Devuelve un resumen.
+
+    Pensado para correr fuera del dashboard (cron, deploy): el primer usuario ya encuentra todo en disco.
+    Con `forzar=True` se descartan antes todos los snapshots y artefactos.
+    """
+    if forzar and os.path.isdir(CARPETA_CACHE):
+        for f in os.listdir(CARPETA_CACHE):
+            if f.endswith((".arrow", ".json")):
+                os.remove(os.path.join(CARPETA_CACHE, f))
+        shutil.rmtree(os.path.join(CARPETA_CACHE, "particiones"), ignore_errors=True)
+
+    iniciar_traza("precalcular")
+    t0 = time.perf_counter()
+    huellas = huellas_fuentes()
+    df_unificado = construir_tabla_unificada(*huellas, avisos=avisos)
+    t_tabla = time.perf_counter() - t0
+    if df_unificado is None:
+        cerrar_traza(ok=False)
+        return {"huellas": huellas, "ok": False}
+
+    df_cubo = construir_cubo(*huellas, df_unificado=df_unificado, avisos=avisos)
+    df_mes = construir_cubo_mensual(*huellas, df_cubo=df_cubo, avisos=avisos)
+    cerrar_traza(ok=True, filas_tabla=len(df_unificado), filas_cubo=len(df_cubo), filas_cubo_mensual=len(df_mes))
+    return {
+        "huellas": huellas,
+        "ok": True,
+        "filas_tabla": len(df_unificado),
+        "filas_cubo": len(df_cubo),
+        "filas_cubo_mensual": len(df_mes),
+        "segundos_tabla": t_tabla,
+        "segundos_total": time.perf_counter() - t0,
+    }
+
+# --------------------------------------------------------------------------
+# 6. ÍNDICE DE FILTROS
+# --------------------------------------------------------------------------
+# Orden de la cascada del sidebar (cada filtro ofrece solo valores de las filas que sobreviven a los anteriores)
+DIMENSIONES_FILTRO = ['Segmento LB', 'MARCA', 'CLASIFICACIÓN DR', 'ACCOUNT MANAGER', 'DEPARTAMENTO', 'PROVINCIA', 'DISTRITO',
+                      'CAI_Clean', 'CLIENTE']
+# Dimensiones con buscador (typeahead) y la columna que completa su etiqueta y el texto buscable
+DIMENSIONES_BUSQUEDA = {'CAI_Clean': 'DENOMINATION', 'CLIENTE': 'COD.CLIENTE'}
+LIMITE_SUGERENCIAS = 50
+
+def _normalizar_busqueda(textos):
+    """Minúsculas, sin tildes y con la puntuación como espacio; con un espacio adelante para ubicar inicios de palabra."""
+    serie = pd.Series(textos, dtype=object).astype(str)
+    serie = serie.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.lower()
+    return " " + serie.str.replace(r"[^0-9a-z]+", " ", regex=True).str.strip()
+
+@etapa("indice_filtros")
+def construir_indice_filtros(df):
+    """Índice invertido del cubo: por dimensión, códigos por fila y filas ordenadas por código.
+
+    Las filas con el valor k son `orden[limites[k]:limites[k + 1]]` (lista ordenada de row-ids). Las
+    dimensiones de DIMENSIONES_BUSQUEDA llevan además, por valor distinto (no por fila), la etiqueta que
+    ve el usuario y el texto normalizado sobre el que busca `buscar`.
+    """
+    indice = {"n_filas": len(df)}
+    for col in DIMENSIONES_FILTRO:
+        if col not in df.columns:
+            continue
+        serie = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype(str).astype('category')
+        categorias = np.asarray(serie.cat.categories.astype(str))
+        codigos = serie.cat.codes.to_numpy()
+        orden = np.argsort(codigos, kind='stable')
+        limites = np.searchsorted(codigos[orden], np.arange(len(categorias) + 1))
+        indice[col] = {"categorias": categorias, "codigos": codigos, "orden": orden, "limites": limites}
+
+        col_extra = DIMENSIONES_BUSQUEDA.get(col)
+        if col_extra is None:
+            continue
+        etiquetas = categorias.astype(object)
+        if col_extra in df.columns and len(df):
+            # Dato complementario de la primera fila de cada valor (ej. la descripción del CAI)
+            primeras = orden[np.minimum(limites[:-1], len(df) - 1)]
+            extra = df[col_extra].astype(str).to_numpy()[primeras]
+            etiquetas = etiquetas + " - " + extra.astype(object)
+        indice[col]["etiquetas"] = etiquetas
+        indice[col]["texto"] = _normalizar_busqueda(etiquetas).to_numpy()
+        indice[col]["texto_codigo"] = _normalizar_busqueda(categorias).str.strip().to_numpy()
+    return indice
+
+def buscar(indice, col, texto, mascara=None, limite=LIMITE_SUGERENCIAS):
+    """Valores de `col` presentes en las filas marcadas que coinciden con lo tipeado, del mejor al peor.
+
+    Cada palabra tipeada debe aparecer en el código o la etiqueta. Primero el código exacto, luego los
+    códigos que empiezan igual, luego los que tienen todas las palabras como inicio de palabra y al final
+    el resto; a igual nivel, los de más filas. Sin texto devuelve los más frecuentes. Máximo `limite`.
+    """
+    dim = indice[col]
+    codigos = dim["codigos"] if mascara is None else dim["codigos"][mascara]
+    peso = np.bincount(codigos[codigos >= 0], minlength=len(dim["categorias"]))
+    candidatos = np.flatnonzero(peso > 0)
+    consulta = _normalizar_busqueda([texto or ""]).iloc[0].strip()
+
+    nivel = np.zeros(len(candidatos), dtype=np.int8)
+    if consulta:
+        textos = pd.Series(dim["texto"][candidatos])
+        en_parte = np.ones(len(candidatos), dtype=bool)
+        inicio_palabra = np.ones(len(candidatos), dtype=bool)
+        for palabra in consulta.split():
+            en_parte &= textos.str.contains(palabra, regex=False).to_numpy()
+            inicio_palabra &= textos.str.contains(" " + palabra, regex=False).to_numpy()
+        codigo = pd.Series(dim["texto_codigo"][candidatos])
+        nivel = np.select([(codigo == consulta).to_numpy(), codigo.str.startswith(consulta).to_numpy(),
+                           inicio_palabra, en_parte], [0, 1, 2, 3], 4)
+        candidatos, nivel = candidatos[nivel < 4], nivel[nivel < 4]
+
+    # A igual nivel y peso queda el orden alfabético de las categorías
+    orden = np.lexsort((candidatos, -peso[candidatos], nivel))[:limite]
+    return dim["categorias"][candidatos[orden]].tolist()
+
+def etiquetas_busqueda(indice, col):
+    """{valor: etiqueta} para mostrar en el selector (ej. CAI ➝ 'CAI - Descripción')."""
+    dim = indice.get(col, {})
+    return dict(zip(dim.get("categorias", []), dim.get("etiquetas", [])))
+
+def opciones_disponibles(indice, col, mascara):
+    """Valores de `col` presentes en las filas marcadas (sin materializar un DataFrame)."""
+    dim = indice[col]
+    codigos = dim["codigos"] if mascara is None else dim["codigos"][mascara]
+    presentes = np.bincount(codigos[codigos >= 0], minlength=len(dim["categorias"])) > 0
+    return dim["categorias"][presentes].tolist()
+
+def aplicar_seleccion(indice, col, seleccion, mascara):
+    """Intersección de la máscara actual con el bitmap de los valores elegidos."""
+    dim = indice[col]
+    codigos_sel = np.flatnonzero(np.isin(dim["categorias"], list(seleccion)))
+    filas = [dim["orden"][dim["limites"][k]:dim["limites"][k + 1]] for k in codigos_sel]
+    bitmap = np.zeros(indice["n_filas"], dtype=bool)
+    if filas:
+        bitmap[np.concatenate(filas)] = True
+    return bitmap if mascara is None else mascara & bitmap
+
+# --------------------------------------------------------------------------
+# 7. TENDENCIAS (VENTANAS MÓVILES Y ÁRBOL)
+# --------------------------------------------------------------------------
+# Periodos móviles: "nM" = n meses, "nY" = n años (admite decimales, ej. 1.5Y), "YTD" = año en curso
+VENTANAS_DISPONIBLES = ["1M", "3M", "6M", "YTD", "1Y", "1.5Y", "2Y"]
+VENTANAS_DEFAULT = ["6M", "1Y", "1.5Y"]
+ANIOS_TOTALES = 4  # Cuántos años (los más recientes de los datos) se muestran como "Total AAAA"
+
+def resolver_ventana(label, fecha_max):
+    """Tramos (ini, fin] del periodo actual y del anterior para una ventana del tipo 6M, 1.5Y o YTD."""
+    if label == "YTD":
+        ini_act = pd.Timestamp(year=fecha_max.year, month=1, day=1) - pd.Timedelta(1, "ns")
+        un_anio = pd.DateOffset(years=1)
+        return {"label": label, "titulo": f"Periodo {label}",
+                "act": (ini_act, fecha_max), "prev": (ini_act - un_anio, fecha_max - un_anio)}
+
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([MY])", label)
+    if not match:
+        raise ValueError(f"Ventana no reconocida: {label}")
+    meses = int(round(float(match.group(1)) * (12 if match.group(2) == "Y" else 1)))
+    ini_act = fecha_max - pd.DateOffset(months=meses)
+    ini_prev = ini_act - pd.DateOffset(months=meses)
+    return {"label": label, "titulo": f"Periodo {label}", "act": (ini_act, fecha_max), "prev": (ini_prev, ini_act)}
+
+def ventana_rango(desde, hasta):
+    """Rango de fechas personalizado (ambos días incluidos) comparado con el tramo de igual duración anterior."""
+    ini_act = pd.Timestamp(desde) - pd.Timedelta(1, "ns")
+    fin_act = pd.Timestamp(hasta) + pd.Timedelta(days=1) - pd.Timedelta(1, "ns")
+    duracion = fin_act - ini_act
+    return {"label": "Rango", "titulo": f"{pd.Timestamp(desde):%d/%m/%y} – {pd.Timestamp(hasta):%d/%m/%y}",
+            "act": (ini_act, fin_act), "prev": (ini_act - duracion, ini_act)}
+
+def anios_de_datos(fechas, cantidad=ANIOS_TOTALES):
+    """Los últimos `cantidad` años presentes en el rango de fechas de los datos (incluye 2026 en adelante)."""
+    fechas = fechas.dropna()
+    if fechas.empty:
+        return []
+    anio_min, anio_max = fechas.min().year, fechas.max().year
+    return list(range(max(anio_min, anio_max - cantidad + 1), anio_max + 1))
+
+def meses_borde(ventanas):
+    """Primer día de cada mes que algún tramo de las ventanas corta a la mitad (ordenados).
+
+    Un borde justo en el cambio de mes (ej. los totales anuales o YTD) no corta ninguno.
+    """
+    meses = set()
+    for v in ventanas:
+        for borde in (*v["act"], *v["prev"]):
+            siguiente = pd.Timestamp(borde) + pd.Timedelta(1, "ns")
+            if siguiente != siguiente.to_period('M').to_timestamp():
+                meses.add(pd.Timestamp(borde).to_period('M').to_timestamp())
+    return sorted(meses)
+
+@etapa("filas_ventanas")
+def filas_ventanas(df_mes, df_dia, ventanas, selecciones=None, columnas=None, filtrar=None):
+    """Filas sobre las que se calculan las ventanas: el cubo mensual ya filtrado, salvo los meses que algún
+    tramo corta a la mitad, que se reemplazan por sus filas del cubo diario (con los mismos filtros, aplicados
+    con `filtrar(df, selecciones)` del motor de consultas si se pasa). Con `columnas` se copian solo esas
+    (las claves de la grilla, CANTIDAD y FECHA_DT).
+
+    Un mes que ningún tramo corta cae entero dentro o fuera de cada uno, así que alcanza con su total y su
+    última compra; solo los meses de borde necesitan el detalle por día. Las sumas y la última compra dan
+    lo mismo que sobre el cubo diario, pero las filas crecen con grupos × meses y no con los días de compra.
+    """
+    columnas = [c for c in (columnas or df_mes.columns) if c in df_mes.columns]
+    meses = meses_borde(ventanas)
+    if not meses or df_dia is None or df_mes.empty:
+        return df_mes if len(columnas) == len(df_mes.columns) else df_mes[columnas]
+    inicios = np.array(meses, dtype='datetime64[ns]')
+    de_borde = np.isin(df_mes['MES'].to_numpy(dtype='datetime64[ns]'), inicios)
+
+    # El cubo diario está ordenado por fecha: cada mes de borde es un rango contiguo
+    fechas = df_dia['FECHA_DT'].to_numpy(dtype='datetime64[ns]')
+    desde = np.searchsorted(fechas, inicios, side='left')
+    hasta = np.searchsorted(fechas, (inicios.astype('datetime64[M]') + 1).astype('datetime64[ns]'), side='left')
+    filas = np.concatenate([np.arange(lo, hi) for lo, hi in zip(desde, hasta)])
+    columnas = [c for c in columnas if c in df_dia.columns]
+    cols_filtro = [c for c in (selecciones or {}) if c in df_dia.columns and c not in columnas]
+    df_borde = df_dia.iloc[filas, [df_dia.columns.get_loc(c) for c in columnas + cols_filtro]]
+    if selecciones:
+        df_borde = filtrar(df_borde, selecciones) if filtrar else df_borde[mascara_selecciones(df_borde, selecciones)]
+    return pd.concat([df_mes.loc[~de_borde, columnas], df_borde[columnas]], ignore_index=True)
+
+@etapa("ventanas")
+def calcular_ventanas(df, cols_base, ventanas, anios):
+    """Agrega por `cols_base` la cantidad de cada ventana (actual y previa) y de cada año, en una sola pasada.
+
+    Las filas se ordenan una vez por fecha; cada tramo es un rango contiguo que se ubica con searchsorted
+    y se suma por grupo con bincount, sin crear una columna enmascarada por ventana.
+    """
+    grupos = df.groupby(cols_base, observed=True)
+    df_grid = grupos['CANTIDAD'].sum().reset_index()
+    n_grupos = len(df_grid)
+
+    gid = grupos.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    fechas = df['FECHA_DT'].to_numpy(dtype='datetime64[ns]')
+    cantidad = df['CANTIDAD'].to_numpy(dtype=np.float64)
+    validas = (gid >= 0) & ~np.isnat(fechas)
+    orden = np.argsort(fechas[validas], kind='stable')
+    fechas, gid, cantidad = fechas[validas][orden], gid[validas][orden], cantidad[validas][orden]
+
+    es_entero = pd.api.types.is_integer_dtype(df['CANTIDAD'])
+    def suma_tramo(ini, fin):
+        lo = np.searchsorted(fechas, np.datetime64(ini, 'ns'), side='right')
+        hi = np.searchsorted(fechas, np.datetime64(fin, 'ns'), side='right')
+        total = np.bincount(gid[lo:hi], weights=cantidad[lo:hi], minlength=n_grupos)
+        return total.round().astype(np.int64) if es_entero else total
+
+    for v in ventanas:
+        df_grid[f'Q_Act_{v["label"]}'] = suma_tramo(*v["act"])
+        df_grid[f'Q_Prev_{v["label"]}'] = suma_tramo(*v["prev"])
+
+    for anio in anios:
+        df_grid[f'Total {anio}'] = suma_tramo(pd.Timestamp(anio, 1, 1) - pd.Timedelta(1, "ns"),
+                                              pd.Timestamp(anio + 1, 1, 1) - pd.Timedelta(1, "ns"))
+
+    # Fecha de Última Compra (mismo groupby, mismo orden de grupos: no hace falta merge)
+    df_grid['FECHA_DT'] = grupos['FECHA_DT'].max().to_numpy()
+    return df_grid
+
+# Estado de un par en una ventana, del peor al mejor (orden de las categorías y de la columna en la grilla)
+ESTADOS_TENDENCIA = ['💀', '🔴', '⚪', '🟡', '🟢', '✨']
+
+def clasificar_tendencia(prev, act):
+    """Estado de cada fila según la cantidad del periodo previo y el actual (nulos = 0), como categórica.
+
+    💀 dejó de comprar, ✨ empezó a comprar, 🟢 sube, 🔴 baja, ⚪ sin compras en ninguno, 🟡 igual.
+    """
+    prev = np.nan_to_num(np.asarray(prev, dtype=np.float64))
+    act = np.nan_to_num(np.asarray(act, dtype=np.float64))
+    codigos = np.select([(act == 0) & (prev > 0), (prev == 0) & (act > 0), act > prev, act < prev, act == 0],
+                        [0, 5, 4, 1, 2], 3).astype(np.int8)
+    return pd.Categorical.from_codes(codigos, categories=ESTADOS_TENDENCIA)
+
+def agregar_tendencias(df_grid):
+    """Columna Trend_<ventana> por cada par Q_Prev_/Q_Act_ de la grilla (o de sus filas ya agregadas)."""
+    for col_act in [c for c in df_grid.columns if c.startswith('Q_Act_')]:
+        label = col_act[len('Q_Act_'):]
+        df_grid[f'Trend_{label}'] = clasificar_tendencia(df_grid[f'Q_Prev_{label}'], df_grid[col_act])
+    return df_grid
+
+@etapa("preparar_grid")
+def preparar_grid(df_grid):
+    """Columnas que consume AG-Grid: última compra como epoch en ms, descripción de producto combinada y el
+    estado de tendencia de cada ventana (se puede ordenar, filtrar y exportar como cualquier columna).
+    """
+    fechas = df_grid['FECHA_DT']
+    df_grid['MAX_DATE_TS'] = np.where(fechas.notna(), fechas.to_numpy(dtype='datetime64[ms]').astype('int64'), 0)
+
+    if 'DENOMINATION' in df_grid.columns:
+        descripcion = df_grid['CAI_Clean'].astype(str) + " | " + df_grid['DENOMINATION'].astype(object).fillna("").astype(str)
+    else:
+        descripcion = df_grid['CAI_Clean'].astype(str)
+    # Categórica: la grilla queda viva en cada sesión hasta su próximo rerun y un texto por fila pesa más
+    # que toda la tabla numérica (las categorías quedan en orden alfabético, igual que al ordenar el texto)
+    df_grid['PRODUCTO_DESC'] = descripcion.astype('category')
+    return agregar_tendencias(df_grid)
+
+TOP_MOVIMIENTOS = 20
+
+def _top_n(valores, n):
+    """Posiciones de los `n` mayores valores, de mayor a menor, con selección parcial (sin ordenar todo)."""
+    if n <= 0 or len(valores) == 0:
+        return np.array([], dtype=np.int64)
+    idx = np.argpartition(-valores, n - 1)[:n] if n < len(valores) else np.arange(len(valores))
+    return idx[np.argsort(-valores[idx], kind='stable')]
+
+@etapa("movimientos")
+def reporte_movimientos(df_grid, label, n=TOP_MOVIMIENTOS):
+    """Pares cliente-producto de la grilla que más suben (🟢), más bajan (🔴), se perdieron (💀) y son nuevos (✨).
+
+    Devuelve {estado: (top n del estado, cantidad total de pares en ese estado)}. Suben y bajan se ordenan
+    por la diferencia, los perdidos por lo que compraban antes y los nuevos por lo que compran ahora.
+    """
+    prev = df_grid[f'Q_Prev_{label}'].to_numpy()
+    act = df_grid[f'Q_Act_{label}'].to_numpy()
+    delta = act - prev
+    estado = np.asarray(df_grid[f'Trend_{label}'].cat.codes)
+    pesos = {'🟢': delta, '🔴': -delta, '💀': prev, '✨': act}
+    cols = [c for c in ['CLIENTE', 'PRODUCTO_DESC'] if c in df_grid.columns]
+
+    reportes = {}
+    for simbolo, peso in pesos.items():
+        filas = np.flatnonzero(estado == ESTADOS_TENDENCIA.index(simbolo))
+        top = filas[_top_n(peso[filas].astype(np.float64), n)]
+        df_top = df_grid[cols].iloc[top].astype(str).reset_index(drop=True)
+        df_top['Prev'], df_top['Act'], df_top['Δ'] = prev[top], act[top], delta[top]
+        df_top['Δ %'] = np.where(prev[top] > 0, delta[top] / np.where(prev[top] > 0, prev[top], 1) * 100, np.nan).round(1)
+        reportes[simbolo] = (df_top, len(filas))
+    return reportes
+
+# A partir de esta cantidad de hojas (cliente × CAI) el árbol se envía por demanda
+UMBRAL_HOJAS_ARBOL = 5000
+# La ruta del árbol viaja como texto (las listas no pasan limpias por st_aggrid); este carácter separa niveles
+SEPARADOR_RUTA = "␟"
+
+def agregar_nivel(df_grid, col_nivel):
+    """Fila pre-agregada en el servidor por cada valor de `col_nivel` (sumas, última compra e ítems)."""
+    cols_suma = [c for c in df_grid.columns if c.startswith(('CANTIDAD', 'Q_Act_', 'Q_Prev_', 'Total '))]
+    agregaciones = {c: 'sum' for c in cols_suma}
+    agregaciones['MAX_DATE_TS'] = 'max'
+    df_nivel = df_grid.groupby(col_nivel, observed=True, sort=True).agg(agregaciones)
+    df_nivel['ITEMS'] = df_grid.groupby(col_nivel, observed=True, sort=True).size()
+    return df_nivel.reset_index()
+
+@etapa("arbol_por_demanda")
+def filas_arbol_por_demanda(df_grid, nivel_1, nivel_2, expandidos):
+    """Filas para el árbol de AG-Grid (treeData): todos los grupos de primer nivel ya agregados (con su
+    estado de tendencia) y solo las hojas de los grupos que el usuario abrió. La ruta de cada fila va en la columna RUTA.
+    """
+    df_top = agregar_tendencias(agregar_nivel(df_grid, nivel_1))
+    df_top[nivel_1] = df_top[nivel_1].astype(str)
+    df_top['RUTA'] = df_top[nivel_1]
+
+    claves = df_grid[nivel_1].astype(str)
+    df_hijos = df_grid[claves.isin(expandidos)].drop(columns=['FECHA_DT'], errors='ignore').copy()
+    df_hijos['RUTA'] = df_hijos[nivel_1].astype(str) + SEPARADOR_RUTA + df_hijos[nivel_2].astype(str)
+    df_hijos['ITEMS'] = 1
+    return pd.concat([df_top, df_hijos[[c for c in df_top.columns if c in df_hijos.columns]]], ignore_index=True)
+
+# --------------------------------------------------------------------------
+# 8. CACHÉ LRU DE GRILLAS (COMPARTIDA ENTRE SESIONES)
+# --------------------------------------------------------------------------
+class CacheLRU:
+    """Resultados por clave con desalojo LRU por cantidad de entradas y por memoria total, segura entre hilos.
+
+    La clave empieza por la versión de los datos (las huellas): al guardar un resultado de otra versión se
+    descarta todo lo anterior. Cada consulta se cuenta como 'memoria:<nombre>' en resumen_cache(). Los
+    valores se comparten entre sesiones: quien los recibe no debe modificarlos.
+    """
+
+    def __init__(self, nombre, max_entradas, max_mb):
+        self.nombre = nombre
+        self.max_entradas = max_entradas
+        self.max_bytes = max_mb * 1024 ** 2
+        self.desalojos = 0
+        self._entradas = OrderedDict()  # clave ➝ (valor, bytes), de la menos a la más usada
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+        registrar_cache("memoria", self.nombre, entrada is not None)
+        return None if entrada is None else entrada[0]
+
+    def guardar(self, clave, valor):
+        """Guarda y devuelve el valor; uno que solo no entra en el límite de memoria no se guarda."""
+        tamano = int(valor.memory_usage(deep=True).sum()) if isinstance(valor, pd.DataFrame) else 0
+        if tamano > self.max_bytes:
+            return valor
+        with self._lock:
+            for vieja in [c for c in self._entradas if c[0] != clave[0] or c == clave]:
+                self._bytes -= self._entradas.pop(vieja)[1]
+            self._entradas[clave] = (valor, tamano)
+            self._bytes += tamano
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (_, liberados) = self._entradas.popitem(last=False)
+                self._bytes -= liberados
+                self.desalojos += 1
+        return valor
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def resumen(self):
+        with self._lock:
+            return {"entradas": len(self._entradas), "max_entradas": self.max_entradas,
+                    "mb": self._bytes / 1024 ** 2, "max_mb": self.max_bytes / 1024 ** 2,
+                    "desalojos": self.desalojos}
+
+# Límites de la caché de grillas (SELLOUT_GRILLAS_MAX entradas y SELLOUT_GRILLAS_MB megas en total)
+CACHE_GRILLAS = CacheLRU("grilla", int(os.environ.get("SELLOUT_GRILLAS_MAX", "64")),
+                         float(os.environ.get("SELLOUT_GRILLAS_MB", "512")))
+
+def clave_grilla(huellas, selecciones, ventanas):
+    """Clave normalizada de df_final_grid: versión de datos, filtros (ordenados) y tramos de cada ventana.
+
+    El orden en que se marcaron los filtros o sus valores no cambia la clave; la vista del árbol tampoco
+    entra porque solo cambia cómo se arma el payload a partir de la misma grilla.
+    """
+    filtros = tuple(sorted((col, tuple(sorted(map(str, valores)))) for col, valores in selecciones.items() if valores))
+    tramos = tuple((v["label"], v["act"], v["prev"]) for v in ventanas)
+    return (tuple(huellas), filtros, tramos)
+
+# --------------------------------------------------------------------------
+# 9. VIGILANCIA DE FUENTES (ACTUALIZACIÓN EN SEGUNDO PLANO)
+# --------------------------------------------------------------------------
+# Cada cuántos segundos se revisan las fuentes (SELLOUT_VIGILAR_SEG; 0 = sin hilo, se revisa en cada rerun)
+INTERVALO_VIGILANCIA = float(os.environ.get("SELLOUT_VIGILAR_SEG", "30"))
+
+def id_version(huellas):
+    """Identificador corto de una versión de datos (sus tres huellas), para mostrar."""
+    return hashlib.blake2b(repr(tuple(huellas)).encode(), digest_size=4).hexdigest()
+
+class VigilanteFuentes:
+    """Publica la versión de datos activa y la renueva en segundo plano cuando cambian las fuentes.
+
+    Un hilo revisa las fuentes cada `intervalo` segundos. Un cambio solo se toma cuando la firma (mtime y
+    tamaño) se repite en dos revisiones seguidas, para no leer un archivo que todavía se está copiando.
+    Entonces `preparar(huellas)` construye la versión nueva (en disco solo se rehacen los artefactos de la
+    fuente que cambió) mientras las sesiones siguen usando la anterior, y al terminar se publica de una sola
+    vez. `preparar` devuelve (hay_datos, avisos); si falla, las fuentes nuevas no tienen Sell Out o algún
+    aviso de la carga es un error, se mantiene la anterior y queda el error.
+    """
+
+    def __init__(self, preparar, intervalo=INTERVALO_VIGILANCIA):
+        self.preparar = preparar
+        self.intervalo = intervalo
+        self.error = None
+        self.construyendo = None  # huellas de la versión en preparación
+        self._activa = None
+        self._fallida = None  # huellas que ya fallaron: no se reintentan hasta que vuelvan a cambiar
+        self._firma = None  # firma de la última revisión: se construye cuando se repite
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def activa(self):
+        """Versión que deben usar las sesiones: {'huellas', 'id', 'construida', 'segundos', 'vacia', 'avisos'}.
+
+        La primera vez se prepara en el hilo que llama (los errores le llegan a él) y arranca la vigilancia.
+        Cada rerun debe leerla una sola vez para trabajar con una versión consistente.
+        """
+        if self._activa is None:
+            with self._lock:
+                if self._activa is None:
+                    self._firma = firma_fuentes()
+                    self._activa = self._construir(huellas_fuentes())
+                    self._iniciar()
+        elif self.intervalo <= 0:
+            self.revisar()
+        return self._activa
+
+    def revisar(self):
+        """Una pasada: si cambiaron las fuentes (y ya no cambian) prepara la versión nueva y la publica.
+
+        True si la cambió.
+        """
+        firma, firma_previa = firma_fuentes(), self._firma
+        self._firma = firma
+        if firma != firma_previa:
+            return False  # algo se está escribiendo: se espera a que la firma se repita
+        huellas = huellas_fuentes()
+        if huellas == self._activa["huellas"]:
+            self._fallida = self.error = None  # las fuentes volvieron a la versión publicada
+            return False
+        if huellas == self._fallida:
+            return False
+        propia = traza_actual() is None
+        if propia:
+            iniciar_traza("actualizacion")
+        self.construyendo = huellas
+        try:
+            nueva = self._construir(huellas)
+            if nueva["vacia"] and not self._activa["vacia"]:
+                raise ValueError("las fuentes nuevas no tienen datos de Sell Out")
+            errores = [mensaje for nivel, mensaje in nueva["avisos"] if nivel == "error"]
+            if errores:
+                raise ValueError("; ".join(errores))
+        except Exception as e:
+            self._fallida, self.error = huellas, f"{e}"
+            return False
+        else:
+            self._activa, self._fallida, self.error = nueva, None, None
+            return True
+        finally:
+            self.construyendo = None
+            if propia:
+                cerrar_traza(version=id_version(huellas), error=self.error)
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    def _construir(self, huellas):
+        t0 = time.perf_counter()
+        hay_datos, avisos = self.preparar(huellas)
+        return {"huellas": huellas, "id": id_version(huellas), "construida": time.time(),
+                "segundos": time.perf_counter() - t0, "vacia": not hay_datos, "avisos": list(avisos)}
+
+    def _iniciar(self):
+        if self.intervalo > 0 and self._hilo is None:
+            self._hilo = threading.Thread(target=self._vigilar, name="vigilante-fuentes", daemon=True)
+            self._hilo.start()
+
+    def _vigilar(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                self.revisar()
+            except Exception as e:  # el hilo no debe morir: se reintenta en la próxima vuelta
+                self.error = f"{e}"
+
+# --------------------------------------------------------------------------
+# 10. SERIES MENSUALES (GRÁFICOS DE TENDENCIA)
+# --------------------------------------------------------------------------
+SERIES_MAX = 10  # Series por gráfico en el desglose (las de más volumen; el resto va a "Otros")
+PUNTOS_MAX = 2000  # Puntos entre todas las series de un gráfico; más allá se submuestrea con LTTB
+PUNTOS_MIN_SERIE = 60
+
+def mascara_selecciones(df, selecciones):
+    """Filas de `df` que cumplen todos los filtros elegidos (columna ➝ valores), como aplicar_seleccion."""
+    mascara = np.ones(len(df), dtype=bool)
+    for col, valores in selecciones.items():
+        if not valores or col not in df.columns:
+            continue
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            codigos_sel = np.flatnonzero(np.isin(np.asarray(serie.cat.categories.astype(str)), list(valores)))
+            mascara &= np.isin(serie.cat.codes.to_numpy(), codigos_sel)
+        else:
+            mascara &= serie.astype(str).isin(valores).to_numpy()
+    return mascara
+
+@etapa("series_mensuales")
+def series_mensuales(df_mes, selecciones=None, por=None, max_series=SERIES_MAX):
+    """CANTIDAD por mes sobre el cubo mensual filtrado: total, o una serie por valor de `por`.
+
+    Devuelve un DataFrame con un índice de meses continuo (los meses sin ventas quedan en 0) y una columna
+    por serie: las `max_series` de más volumen y "Otros" con el resto.
+    """
+    if selecciones:
+        df_mes = df_mes[mascara_selecciones(df_mes, selecciones)]
+    if df_mes.empty:
+        return pd.DataFrame()
+    mes = df_mes['MES'].to_numpy().astype('datetime64[M]').astype(np.int64)  # meses desde 1970
+    primero = int(mes.min())
+    n_meses = int(mes.max()) - primero + 1
+    pos_mes = mes - primero
+    cantidad = df_mes['CANTIDAD'].to_numpy(dtype=np.float64)
+    meses = pd.date_range(pd.Timestamp(np.datetime64(primero, 'M')), periods=n_meses, freq='MS')
+
+    if por is None or por not in df_mes.columns:
+        return pd.DataFrame({"Total": np.bincount(pos_mes, weights=cantidad, minlength=n_meses)}, index=meses)
+
+    serie = df_mes[por] if isinstance(df_mes[por].dtype, pd.CategoricalDtype) else df_mes[por].astype(str).astype('category')
+    codigos = serie.cat.codes.to_numpy().astype(np.int64)
+    n_cat = len(serie.cat.categories)
+    volumen = np.bincount(codigos[codigos >= 0], weights=cantidad[codigos >= 0], minlength=n_cat)
+    presentes = np.flatnonzero(np.bincount(codigos[codigos >= 0], minlength=n_cat))
+    top = presentes[np.argsort(-volumen[presentes], kind='stable')[:max_series]]
+
+    # Cada fila va a su serie (las del top en su posición, el resto a "Otros") y se suma con un bincount 2D
+    destino = np.full(n_cat + 1, len(top), dtype=np.int64)
+    destino[top] = np.arange(len(top))
+    fila_serie = destino[np.where(codigos >= 0, codigos, n_cat)]
+    n_series = len(top) + 1
+    matriz = np.bincount(fila_serie * n_meses + pos_mes, weights=cantidad, minlength=n_series * n_meses)
+    matriz = matriz.reshape(n_series, n_meses)
+
+    nombres = [str(c) for c in np.asarray(serie.cat.categories)[top]]
+    df_series = pd.DataFrame(matriz[:len(top)].T, index=meses, columns=nombres)
+    if matriz[-1].any():
+        df_series["Otros"] = matriz[-1]
+    return df_series
+
+def lttb(y, umbral):
+    """Largest-Triangle-Three-Buckets: índices de `umbral` puntos de `y` (x = posición) que conservan la forma.
+
+    Se quedan el primero y el último; de cada tramo intermedio, el punto que forma el triángulo de mayor área
+    con el elegido del tramo anterior y el promedio del siguiente.
+    """
+    n = len(y)
+    if umbral >= n or umbral < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    x = np.arange(n, dtype=np.float64)
+    bordes = np.floor(np.linspace(1, n - 1, umbral - 1)).astype(np.int64)
+    elegidos = np.empty(umbral, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    previo = 0
+    for i in range(umbral - 2):
+        desde, hasta = bordes[i], bordes[i + 1]
+        siguiente_desde, siguiente_hasta = bordes[i + 1], (bordes[i + 2] if i + 2 < len(bordes) else n)
+        x_prom = x[siguiente_desde:siguiente_hasta].mean()
+        y_prom = y[siguiente_desde:siguiente_hasta].mean()
+        areas = np.abs((x[previo] - x_prom) * (y[desde:hasta] - y[previo])
+                       - (x[previo] - x[desde:hasta]) * (y_prom - y[previo]))
+        previo = desde + int(areas.argmax())
+        elegidos[i + 1] = previo
+    return elegidos
+
+def submuestrear_series(df_series, puntos_max=PUNTOS_MAX):
+    """{serie: (fechas, valores)} con cada serie reducida por LTTB si entre todas pasan de `puntos_max`."""
+    umbral = max(PUNTOS_MIN_SERIE, puntos_max // max(len(df_series.columns), 1))
+    series = {}
+    for nombre in df_series.columns:
+        valores = df_series[nombre].to_numpy()
+        idx = lttb(valores, umbral)
+        series[nombre] = (df_series.index[idx], valores[idx])
+    return series
+
+# --------------------------------------------------------------------------
+# 11. EXPORTACIÓN (XLSX / CSV / PARQUET POR LOTES)
+# --------------------------------------------------------------------------
+CARPETA_EXPORTACIONES = os.path.join(CARPETA_CACHE, "exportaciones")
+FILAS_LOTE_EXPORTACION = 50_000
+FILAS_MAX_HOJA = 1_048_576  # Límite de filas de una hoja de Excel (con el encabezado)
+# Exportaciones que corren a la vez en el proceso (SELLOUT_EXPORTACIONES); las demás esperan su turno
+EXPORTACIONES_SIMULTANEAS = int(os.environ.get("SELLOUT_EXPORTACIONES", "1"))
+VIGENCIA_EXPORTACION_SEG = 3600  # Los archivos generados se borran pasado este tiempo
+TIPOS_EXPORTACION = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+# Columnas internas de la grilla que no tienen sentido en un archivo
+COLS_INTERNAS_GRILLA = ['MAX_DATE_TS', 'RUTA', 'ITEMS']
+
+def columnas_exportacion_grilla(df_grid, nivel_1, nivel_2):
+    """Columnas de la grilla para exportar: los dos niveles del árbol primero y sin las columnas internas."""
+    niveles = [c for c in (nivel_1, nivel_2) if c in df_grid.columns]
+    return niveles + [c for c in df_grid.columns if c not in niveles and c not in COLS_INTERNAS_GRILLA]
+
+def orden_jerarquico(df, nivel_1, nivel_2):
+    """Posiciones de las filas ordenadas por nivel_1 y luego nivel_2 (como se ve el árbol), sin copiar la tabla."""
+    claves = [pd.factorize(df[c], sort=True)[0] for c in (nivel_2, nivel_1) if c in df.columns]
+    return np.lexsort(claves) if claves else np.arange(len(df))
+
+def _lotes(df, columnas, filas, tamano_lote):
+    """Trozos de `df` (solo `columnas`, las `filas` indicadas en ese orden) de a `tamano_lote` filas."""
+    posiciones = [df.columns.get_loc(c) for c in columnas]
+    total = len(df) if filas is None else len(filas)
+    for inicio in range(0, total, tamano_lote):
+        fin = min(inicio + tamano_lote, total)
+        yield df.iloc[slice(inicio, fin) if filas is None else filas[inicio:fin], posiciones]
+
+def _valores_excel(lote):
+    """Columnas del lote como listas de valores Python (nulos = None), que es lo que acepta xlsxwriter."""
+    return [lote[c].astype(object).where(lote[c].notna(), None).tolist() for c in lote.columns]
+
+def _escribir_xlsx(lotes, columnas, path, nombre_hoja):
+    import xlsxwriter
+
+    # constant_memory: cada fila se vuelca al disco al pasar a la siguiente, la memoria no crece con el archivo
+    libro = xlsxwriter.Workbook(path, {"constant_memory": True, "default_date_format": "dd/mm/yyyy",
+                                       "strings_to_formulas": False, "strings_to_urls": False,
+                                       "nan_inf_to_errors": True})
+    negrita = libro.add_format({"bold": True})
+
+    def nueva_hoja(numero):
+        hoja = libro.add_worksheet(nombre_hoja if numero == 1 else f"{nombre_hoja} ({numero})")
+        hoja.write_row(0, 0, [str(c) for c in columnas], negrita)
+        hoja.freeze_panes(1, 0)
+        return hoja
+
+    try:
+        numero_hoja, hoja, fila = 1, nueva_hoja(1), 1
+        for lote in lotes:
+            for valores in zip(*_valores_excel(lote)):
+                if fila == FILAS_MAX_HOJA:
+                    numero_hoja += 1
+                    hoja, fila = nueva_hoja(numero_hoja), 1
+                hoja.write_row(fila, 0, valores)
+                fila += 1
+    finally:
+        libro.close()
+
+def _escribir_csv(lotes, columnas, path):
+    # utf-8 con BOM: Excel reconoce las tildes al abrir el CSV con doble clic
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        pd.DataFrame(columns=columnas).to_csv(f, index=False, lineterminator="\r\n")
+        for lote in lotes:
+            lote.to_csv(f, header=False, index=False, lineterminator="\r\n")
+
+def _escribir_parquet(lotes, vacio, path):
+    import pyarrow.parquet as pq
+
+    escritor = esquema = None
+    try:
+        for lote in lotes:
+            if esquema is None:
+                # Una columna vacía en el primer lote no fija el tipo: se asume texto
+                inferido = pa.Schema.from_pandas(lote, preserve_index=False)
+                esquema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in inferido],
+                                    metadata=inferido.metadata)
+                escritor = pq.ParquetWriter(path, esquema)
+            escritor.write_table(pa.Table.from_pandas(lote, schema=esquema, preserve_index=False))
+        if escritor is None:
+            # Sin filas igual queda un archivo válido con las columnas
+            pq.write_table(pa.Table.from_pandas(vacio, preserve_index=False), path)
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+@etapa("exportacion")
+def exportar(df, formato, path, columnas=None, filas=None, nombre_hoja="Datos", tamano_lote=FILAS_LOTE_EXPORTACION):
+    """Escribe `df` a `path` en xlsx, csv o parquet de a `tamano_lote` filas; devuelve cuántas filas escribió.
+
+    Nunca se arma una copia completa: cada lote se toma de `df` (solo `columnas`, y las `filas` indicadas
+    en ese orden si se pasan, ej. las de un filtro) y se vuelca al archivo antes de pasar al siguiente. El
+    xlsx usa el modo de memoria constante de xlsxwriter y pasa a otra hoja al llegar al límite de Excel.
+    """
+    if formato not in TIPOS_EXPORTACION:
+        raise ValueError(f"Formato de exportación no reconocido: {formato}")
+    columnas = list(df.columns) if columnas is None else list(columnas)
+    lotes = _lotes(df, columnas, filas, tamano_lote)
+    escritores = {
+        "xlsx": lambda tmp: _escribir_xlsx(lotes, columnas, tmp, nombre_hoja),
+        "csv": lambda tmp: _escribir_csv(lotes, columnas, tmp),
+        "parquet": lambda tmp: _escribir_parquet(lotes, df.iloc[:0][columnas], tmp),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _escribir_atomico(path, escritores[formato])
+    return len(df) if filas is None else len(filas)
+
+class Exportaciones:
+    """Exportaciones en hilos de fondo, para que un archivo grande no bloquee el rerun de la sesión.
+
+    Cada pedido escribe su archivo en CARPETA_EXPORTACIONES con `exportar` y se consulta por su id con
+    `estado`. Corren a lo sumo `simultaneas` a la vez (escribir es CPU en Python: más hilos solo le quitan
+    tiempo a las demás sesiones). Los archivos se borran pasada VIGENCIA_EXPORTACION_SEG. Los DataFrames
+    que recibe se comparten con otras sesiones y solo se leen.
+    """
+
+    def __init__(self, simultaneas=EXPORTACIONES_SIMULTANEAS, carpeta=None):
+        self.carpeta = carpeta
+        self._pool = ThreadPoolExecutor(max_workers=max(simultaneas, 1), thread_name_prefix="exportacion")
+        self._pedidos = {}
+        self._lock = threading.Lock()
+
+    def iniciar(self, df, formato, nombre, **opciones):
+        """Encola la exportación de `df` (opciones de `exportar`) y devuelve su id."""
+        self.limpiar()
+        id_pedido = uuid.uuid4().hex[:12]
+        carpeta = self.carpeta or CARPETA_EXPORTACIONES
+        path = os.path.join(carpeta, f"{id_pedido}.{formato}")
+        pedido = {"id": id_pedido, "nombre": f"{nombre}.{formato}", "formato": formato, "path": path,
+                  "creado": time.time(), "segundos": None}
+        pedido["futuro"] = self._pool.submit(self._correr, pedido, df, **opciones)
+        with self._lock:
+            self._pedidos[id_pedido] = pedido
+        return id_pedido
+
+    def estado(self, id_pedido):
+        """{'listo', 'error', 'filas', 'segundos', 'path', 'nombre', 'tipo'} del pedido; None si ya no existe."""
+        with self._lock:
+            pedido = self._pedidos.get(id_pedido)
+        if pedido is None:
+            return None
+        futuro = pedido["futuro"]
+        error = futuro.exception() if futuro.done() else None
+        return {"listo": futuro.done() and error is None, "error": error and f"{error}",
+                "filas": futuro.result() if futuro.done() and error is None else None,
+                "segundos": pedido["segundos"], "path": pedido["path"], "nombre": pedido["nombre"],
+                "tipo": TIPOS_EXPORTACION[pedido["formato"]]}
+
+    def limpiar(self):
+        """Olvida y borra del disco los pedidos terminados más viejos que VIGENCIA_EXPORTACION_SEG.
+
+        También barre los temporales (*.tmp) igual de viejos que dejó un proceso cortado a mitad de una
+        exportación, salvo los de pedidos que siguen corriendo.
+        """
+        limite = time.time() - VIGENCIA_EXPORTACION_SEG
+        with self._lock:
+            vencidos = [p for p in self._pedidos.values() if p["futuro"].done() and p["creado"] < limite]
+            for pedido in vencidos:
+                del self._pedidos[pedido["id"]]
+            en_curso = tuple(os.path.basename(p["path"]) + "." for p in self._pedidos.values() if not p["futuro"].done())
+        for pedido in vencidos:
+            with contextlib.suppress(OSError):
+                os.remove(pedido["path"])
+
+        carpeta = self.carpeta or CARPETA_EXPORTACIONES
+        with contextlib.suppress(OSError):
+            for entrada in os.scandir(carpeta):
+                if (entrada.name.endswith(".tmp") and not entrada.name.startswith(en_curso)
+                        and entrada.stat().st_mtime < limite):
+                    with contextlib.suppress(OSError):
+                        os.remove(entrada.path)
+
+    def _correr(self, pedido, df, **opciones):
+        iniciar_traza("exportacion")
+        t0 = time.perf_counter()
+        error = None
+        try:
+            return exportar(df, pedido["formato"], pedido["path"], **opciones)
+        except Exception as e:
+            error = f"{e}"
+            raise
+        finally:
+            pedido["segundos"] = time.perf_counter() - t0
+            cerrar_traza(formato=pedido["formato"], error=error)
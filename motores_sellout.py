@@ -0,0 +1,187 @@
+"""Motores de consulta intercambiables para el filtrado y la agregación de tendencias.
+
+Todos reciben el mismo cubo en memoria (el de datos_sellout, ya cacheado) y devuelven lo mismo que la
+referencia en pandas: mismas filas, mismo orden, mismas columnas. El dashboard usa `filtrar` para las filas
+finales de la selección, pasándole la máscara que ya armó el índice de filtros del sidebar (así opciones y
+filas salen de los mismos bitmaps; las selecciones solo se evalúan donde no hay índice, como las filas
+diarias de los meses de borde) y `ventanas` para la grilla de tendencias. DuckDB y Polars son dependencias
+opcionales y reparten el trabajo entre todos los núcleos; se eligen con la variable SELLOUT_MOTOR.
+
+La paridad entre motores se verifica con `benchmarks/paridad_motores.py`.
+"""
+import os
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+import datos_sellout as ds
+
+MOTOR_POR_DEFECTO = os.environ.get("SELLOUT_MOTOR", "pandas")
+
+def _tramos(ventanas, anios):
+    """(columna, ini, fin) de cada suma en el orden de columnas de calcular_ventanas, en ns desde epoch."""
+    tramos = []
+    for v in ventanas:
+        tramos.append((f'Q_Act_{v["label"]}',) + v["act"])
+        tramos.append((f'Q_Prev_{v["label"]}',) + v["prev"])
+    for anio in anios:
+        tramos.append((f'Total {anio}', pd.Timestamp(anio, 1, 1) - pd.Timedelta(1, "ns"),
+                       pd.Timestamp(anio + 1, 1, 1) - pd.Timedelta(1, "ns")))
+    return [(col, pd.Timestamp(ini).value, pd.Timestamp(fin).value) for col, ini, fin in tramos]
+
+def _ordenar_como_pandas(df_grid, cols_base, df_origen):
+    """Devuelve las claves con el dtype del origen (categorías incluidas), que fija el orden de los grupos."""
+    for c in cols_base:
+        if isinstance(df_origen[c].dtype, pd.CategoricalDtype):
+            df_grid[c] = pd.Categorical(df_grid[c].astype(object), categories=df_origen[c].cat.categories)
+    return df_grid.sort_values(cols_base, kind='stable', ignore_index=True)
+
+def _ajustar_tipos(df_grid, columnas, df_origen):
+    """Cantidades enteras como int64 (DuckDB suma en 128 bits) y fecha con la resolución del origen, como la referencia."""
+    es_entero = pd.api.types.is_integer_dtype(df_origen['CANTIDAD'])
+    for c in columnas:
+        df_grid[c] = df_grid[c].fillna(0).astype(np.int64 if es_entero else np.float64)
+    df_grid['FECHA_DT'] = pd.to_datetime(df_grid['FECHA_DT']).astype(df_origen['FECHA_DT'].dtype)
+    return df_grid
+
+def _filas_de_mascara(df, mascara):
+    """Filas marcadas de `df` (la máscara del índice de filtros, alineada con sus filas); sin copia si son todas."""
+    return df if mascara.all() else df.take(np.flatnonzero(mascara))
+
+# --------------------------------------------------------------------------
+# PANDAS (REFERENCIA)
+# --------------------------------------------------------------------------
+def filtrar_pandas(df, selecciones, mascara=None):
+    """Filas cuyo valor (como texto, igual que las opciones del sidebar) está en la selección de cada columna.
+
+    Si se pasa `mascara` (la que armó el índice para esas mismas selecciones) se toman sus filas sin volver
+    a evaluarlas; lo mismo en todos los motores.
+    """
+    if mascara is not None:
+        return _filas_de_mascara(df, mascara)
+    mascara = np.ones(len(df), dtype=bool)
+    for col, valores in selecciones.items():
+        serie = df[col]
+        serie = serie if isinstance(serie.dtype, pd.CategoricalDtype) else serie.astype(str).astype('category')
+        elegidas = np.asarray(serie.cat.categories.astype(str).isin(list(valores)))
+        codigos = serie.cat.codes.to_numpy()
+        mascara &= (codigos >= 0) & elegidas[np.maximum(codigos, 0)]
+    return _filas_de_mascara(df, mascara)
+
+# --------------------------------------------------------------------------
+# DUCKDB
+# --------------------------------------------------------------------------
+def _duckdb():
+    import duckdb
+    return duckdb.connect(config={"threads": os.cpu_count() or 1})
+
+def _ident(col):
+    return '"' + col.replace('"', '""') + '"'
+
+def filtrar_duckdb(df, selecciones, mascara=None):
+    """Misma semántica que filtrar_pandas, resuelta en DuckDB sobre el DataFrame sin copiarlo."""
+    if mascara is not None:
+        return _filas_de_mascara(df, mascara)
+    condiciones, parametros = [], []
+    for col, valores in selecciones.items():
+        condiciones.append(f"CAST({_ident(col)} AS VARCHAR) IN (SELECT unnest(?))")
+        parametros.append(list(valores))
+    if not condiciones:
+        return df
+
+    con = _duckdb()
+    try:
+        con.register("hechos", df)
+        # La posición de cada fila sale de una columna numerada (DuckDB no expone el índice de pandas)
+        filas = con.execute(
+            f"SELECT fila FROM (SELECT row_number() OVER () - 1 AS fila, * FROM hechos) "
+            f"WHERE {' AND '.join(condiciones)} ORDER BY fila", parametros
+        ).fetchnumpy()["fila"]
+    finally:
+        con.close()
+    return df.take(np.asarray(filas, dtype=np.int64))
+
+@ds.etapa("ventanas")
+def ventanas_duckdb(df, cols_base, ventanas, anios):
+    """calcular_ventanas en una sola consulta: una suma condicional por tramo (ini, fin]."""
+    tramos = _tramos(ventanas, anios)
+    claves = ", ".join(_ident(c) for c in cols_base)
+    sumas = ", ".join(
+        f"SUM(CASE WHEN ts > {ini} AND ts <= {fin} THEN \"CANTIDAD\" ELSE 0 END) AS {_ident(col)}"
+        for col, ini, fin in tramos
+    )
+    no_nulos = " AND ".join(f"{_ident(c)} IS NOT NULL" for c in cols_base)
+    consulta = (
+        f"SELECT {claves}, SUM(\"CANTIDAD\") AS \"CANTIDAD\"{', ' + sumas if sumas else ''}, "
+        f"MAX(\"FECHA_DT\") AS \"FECHA_DT\" "
+        f"FROM (SELECT *, epoch_ns(\"FECHA_DT\") AS ts FROM hechos) WHERE {no_nulos} GROUP BY {claves}"
+    )
+    con = _duckdb()
+    try:
+        con.register("hechos", df[cols_base + ['CANTIDAD', 'FECHA_DT']])
+        df_grid = con.execute(consulta).df()
+    finally:
+        con.close()
+    df_grid = _ajustar_tipos(df_grid, ['CANTIDAD'] + [t[0] for t in tramos], df)
+    return _ordenar_como_pandas(df_grid, cols_base, df)
+
+# --------------------------------------------------------------------------
+# POLARS
+# --------------------------------------------------------------------------
+def _polars(df, columnas):
+    import polars as pl
+    # Las categóricas pasan como Categorical de Polars (sin copiar los textos fila a fila)
+    return pl, pl.from_pandas(df[columnas])
+
+def filtrar_polars(df, selecciones, mascara=None):
+    """Misma semántica que filtrar_pandas, con expresiones de Polars."""
+    if mascara is not None:
+        return _filas_de_mascara(df, mascara)
+    if not selecciones:
+        return df
+    pl, tabla = _polars(df, sorted(selecciones))
+    condicion = pl.lit(True)
+    for col, valores in selecciones.items():
+        condicion = condicion & pl.col(col).cast(pl.String).is_in(list(valores)).fill_null(False)
+    filas = tabla.with_row_index("fila").filter(condicion)["fila"].to_numpy()
+    return df.take(filas.astype(np.int64))
+
+@ds.etapa("ventanas")
+def ventanas_polars(df, cols_base, ventanas, anios):
+    """calcular_ventanas con un group_by de Polars y una suma filtrada por tramo (ini, fin]."""
+    tramos = _tramos(ventanas, anios)
+    pl, tabla = _polars(df, cols_base + ['CANTIDAD', 'FECHA_DT'])
+    ts = pl.col('FECHA_DT').cast(pl.Datetime('ns')).cast(pl.Int64)
+    cantidad = pl.col('CANTIDAD')
+    sumas = [cantidad.filter((ts > ini) & (ts <= fin)).sum().alias(col) for col, ini, fin in tramos]
+    df_grid = (
+        tabla.drop_nulls(cols_base)
+        .group_by(cols_base)
+        .agg([cantidad.sum().alias('CANTIDAD')] + sumas + [pl.col('FECHA_DT').max()])
+        .to_pandas()
+    )
+    df_grid = _ajustar_tipos(df_grid, ['CANTIDAD'] + [t[0] for t in tramos], df)
+    return _ordenar_como_pandas(df_grid, cols_base, df)
+
+# --------------------------------------------------------------------------
+# REGISTRO
+# --------------------------------------------------------------------------
+MOTORES = {
+    "pandas": {"modulo": None, "filtrar": filtrar_pandas, "ventanas": ds.calcular_ventanas},
+    "duckdb": {"modulo": "duckdb", "filtrar": filtrar_duckdb, "ventanas": ventanas_duckdb},
+    "polars": {"modulo": "polars", "filtrar": filtrar_polars, "ventanas": ventanas_polars},
+}
+
+def motores_disponibles():
+    """Motores cuya dependencia está instalada (pandas siempre)."""
+    return [n for n, m in MOTORES.items() if m["modulo"] is None or importlib.util.find_spec(m["modulo"])]
+
+def obtener_motor(nombre=None):
+    """Funciones del motor pedido (por defecto SELLOUT_MOTOR); ValueError si no existe o no está instalado."""
+    nombre = nombre or MOTOR_POR_DEFECTO
+    if nombre not in MOTORES:
+        raise ValueError(f"Motor desconocido: {nombre} (opciones: {', '.join(MOTORES)})")
+    if nombre not in motores_disponibles():
+        raise ValueError(f"El motor {nombre} necesita instalar el paquete '{MOTORES[nombre]['modulo']}'")
+    return MOTORES[nombre]
@@ -0,0 +1,49 @@
+"""Precálculo del Dashboard de Sell Out (para cron o el hook de deploy).
+
+Arma la tabla unificada y el cubo de ventas y los deja en la carpeta de caché, así la primera visita al
+dashboard solo lee los artefactos desde disco.
+
+Uso:
+    python precalcular.py            # reutiliza lo que siga vigente
+    python precalcular.py --forzar   # descarta snapshots y artefactos y recalcula todo
+    python precalcular.py --procesos 3   # normaliza las tres fuentes en paralelo (por defecto, uno por núcleo)
+"""
+import argparse
+import sys
+
+import datos_sellout as ds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precalcula la tabla unificada y el cubo de Sell Out.")
+    parser.add_argument("--forzar", action="store_true", help="descarta la caché en disco antes de calcular")
+    parser.add_argument("--procesos", type=int, default=None,
+                        help="procesos para leer las fuentes en frío (1 = secuencial)")
+    args = parser.parse_args(argv)
+    if args.procesos:
+        ds.PROCESOS_CARGA = args.procesos
+
+    avisos = []
+    try:
+        resumen = ds.precalcular(forzar=args.forzar, avisos=avisos)
+    except ds.ColumnaFaltanteError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    for nivel, mensaje in avisos:
+        print(f"{nivel.upper()}: {mensaje}", file=sys.stderr)
+    if not resumen["ok"]:
+        print("ERROR: no se encontró el archivo de Sell Out.", file=sys.stderr)
+        return 1
+
+    print(f"Datos: {ds.CARPETA_DATOS}")
+    if ds.listar_particiones():
+        print(f"Particiones: {len(ds.leer_manifiesto())} en {ds.CARPETA_PARTICIONES}")
+    print(f"Caché: {ds.CARPETA_CACHE}")
+    print(f"Tabla unificada: {resumen['filas_tabla']:,} filas ({resumen['segundos_tabla']:.1f} s)")
+    print(f"Cubo: {resumen['filas_cubo']:,} filas (total {resumen['segundos_total']:.1f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())